@@ -0,0 +1,103 @@
+"""
+atomtools command line interface
+
+    atomtools filetype [-j NPROCS] [--partial-length N] PATH [PATH ...]
+    atomtools formats
+    atomtools version
+"""
+
+
+import sys
+import json
+import time
+import argparse
+import atomtools
+
+
+PROGRESS_INTERVAL = 10
+
+
+def run_filetype(args):
+    from . import filetype
+    start = last_report = time.time()
+    nfiles = 0
+    for filename, ftype in filetype.scan_filetypes(
+            args.paths, nprocs=args.nprocs, size=args.partial_length,
+            recursive=not args.no_recursive, chunksize=args.chunksize):
+        args.output.write(json.dumps(
+            {'filename': filename, 'filetype': ftype}) + '\n')
+        nfiles += 1
+        now = time.time()
+        if args.progress and now - last_report > args.progress:
+            last_report = now
+            sys.stderr.write('{0} files, {1:.1f} files/s\n'.format(
+                nfiles, nfiles / (now - start)))
+    elapsed = time.time() - start
+    sys.stderr.write('{0} files in {1:.2f} s, {2:.1f} files/s\n'.format(
+        nfiles, elapsed, nfiles / elapsed if elapsed else 0))
+
+
+def run_formats(args):
+    from . import filetype
+    for fmt in sorted(set(filetype.list_supported_formats())):
+        print(fmt)
+
+
+def run_version(args):
+    print(atomtools.version())
+
+
+SUBCOMMANDS = {
+    'filetype': run_filetype,
+    'formats': run_formats,
+    'version': run_version,
+}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='atomtools', description='basic atom tools collection')
+    subparsers = parser.add_subparsers(dest='subcommand')
+
+    parser_filetype = subparsers.add_parser(
+        'filetype', help='classify files, output JSON lines')
+    parser_filetype.add_argument('paths', nargs='+',
+                                 help='files or directories')
+    parser_filetype.add_argument('-j', '--nprocs', type=int, default=None,
+                                 help='number of processes, default all '
+                                 'cores of the allocation')
+    parser_filetype.add_argument('--partial-length', type=int, default=None,
+                                 help='read only the first N bytes of files')
+    parser_filetype.add_argument('--no-recursive', action='store_true',
+                                 help='do not walk into subdirectories')
+    parser_filetype.add_argument('--chunksize', type=int, default=64,
+                                 help='files sent to a process at once')
+    parser_filetype.add_argument('--progress', type=float,
+                                 default=PROGRESS_INTERVAL,
+                                 help='seconds between throughput reports, '
+                                 '0 to disable')
+    parser_filetype.add_argument('-o', '--output',
+                                 type=argparse.FileType('w'),
+                                 default=sys.stdout,
+                                 help='output file, default stdout')
+
+    subparsers.add_parser('formats', help='list supported filetypes')
+    subparsers.add_parser('version', help='print version')
+    return parser
+
+
+def run_atomtools_cli(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['LISTSUBCOMMAND']:
+        print('\n'.join(SUBCOMMANDS))
+        return
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.subcommand is None:
+        parser.print_help()
+        return
+    SUBCOMMANDS[args.subcommand](args)
+
+
+if __name__ == '__main__':
+    run_atomtools_cli()
@@ -2,9 +2,15 @@
 Extended type:
     ExtList, rewrite multiple operation
 
+    ExtArray, ExtList operations vectorized with numpy
+
     ExtDict, rewrite getitem so that '/a/b/c/d' -> ['a']['b']['c']['d']
 """
-from collections import Iterable, OrderedDict
+import bisect
+import functools
+from collections import OrderedDict
+from collections.abc import Iterable, MutableMapping
+import numpy as np
 
 
 NO_DEFAULT = '__THIS_MEANS_NO_DEFAULT__'
@@ -85,6 +91,191 @@ class ExtList(list):
         return index
 
 
+class ExtArray(object):
+    """
+    ExtList operations vectorized with numpy, results are identical to
+    the ExtList ones
+
+    >>> ExtArray(['C', 'C', 'H', 'C']).contract_items()
+    ['C', 'H', 'C']
+    """
+
+    def __init__(self, items):
+        if not isinstance(items, np.ndarray):
+            items = list(items)
+            # numpy would turn [1, 'a'] into strings
+            dtype = object if len(set(map(type, items))) > 1 else None
+            items = np.array(items, dtype=dtype)
+        self.array = items
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        return iter(self.array.tolist())
+
+    def __getitem__(self, index):
+        return self.array[index]
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.tolist())
+
+    def tolist(self):
+        return self.array.tolist()
+
+    def __mul__(self, a):
+        assert isinstance(a, Iterable), \
+            'multiplier should be Iterable, instead of {0}'.format(type(a))
+        assert len(self) == len(a), \
+            'multiple length should be same'
+        return self.__class__(np.repeat(self.array, a))
+
+    def __sub__(self, a):
+        index = np.flatnonzero(self.array == a)
+        if len(index) == 0:
+            return self
+        return self.__class__(np.delete(self.array, index[0]))
+
+    def _run_starts(self):
+        if len(self.array) == 0:
+            return np.zeros(0, dtype=int)
+        changed = (self.array[1:] != self.array[:-1]).astype(bool)
+        return np.flatnonzero(np.concatenate([[True], changed]))
+
+    @staticmethod
+    def _outtype(result, outtype):
+        if outtype == 'string':
+            return ' '.join(str(_) for _ in result)
+        return result
+
+    def contract_items(self, outtype=None):
+        return self._outtype(self.array[self._run_starts()].tolist(), outtype)
+
+    def contract_numbers(self, outtype=None):
+        starts = self._run_starts()
+        numbers = np.diff(np.append(starts, len(self.array))).tolist()
+        return self._outtype(numbers, outtype)
+
+    def _groups(self):
+        """distinct items in order of appearance, their counts and inverse"""
+        if self.array.dtype == object:
+            # mixed types can not be sorted, group them with a dict
+            codes = dict()
+            inverse = np.array([codes.setdefault(x, len(codes))
+                                for x in self.array.tolist()], dtype=int)
+            counts = np.bincount(inverse, minlength=len(codes))
+            return list(codes), counts, inverse
+        # group the runs, there are usually far fewer runs than items
+        starts = self._run_starts()
+        lengths = np.diff(np.append(starts, len(self.array)))
+        items, first, inverse = np.unique(
+            self.array[starts], return_index=True, return_inverse=True)
+        order = np.argsort(first, kind='stable')
+        # small codes let the stable argsort use radix sort
+        rank = np.empty(len(order), dtype=np.min_scalar_type(len(order)))
+        rank[order] = np.arange(len(order))
+        run_codes = rank[inverse.ravel()]
+        counts = np.bincount(run_codes, weights=lengths,
+                             minlength=len(order)).astype(int)
+        return items[order].tolist(), counts, np.repeat(run_codes, lengths)
+
+    def _counts(self):
+        items, counts, _ = self._groups()
+        return OrderedDict(zip(items, counts.tolist()))
+
+    def deep_contract_items(self, outtype=None):
+        return self._outtype(self._counts().keys(), outtype)
+
+    def deep_contract_numbers(self, outtype=None):
+        return self._outtype(self._counts().values(), outtype)
+
+    def deep_contract_index(self):
+        """stable group-by: indices grouped by item in order of appearance"""
+        _, _, inverse = self._groups()
+        return np.argsort(inverse, kind='stable').tolist()
+
+
+@functools.lru_cache(maxsize=4096)
+def split_path(name):
+    """'/a/b//c' -> ('a', 'b', 'c'), memoized"""
+    return tuple(key for key in name.split('/') if key)
+
+
+def get_path(data, name):
+    """data['/a/b/c'] -> data['a']['b']['c'], a direct key wins"""
+    if not isinstance(name, str) or dict.__contains__(data, name):
+        return dict.__getitem__(data, name)
+    sdict = data
+    for key in split_path(name):
+        try:
+            sdict = dict.__getitem__(sdict, key)
+        except (KeyError, TypeError):
+            raise KeyError('{0} not exist'.format(key))
+    return sdict
+
+
+def set_path(data, name, value):
+    """data['/a/b/c'] = value, creating the missing levels"""
+    if not isinstance(name, str) or dict.__contains__(data, name):
+        return dict.__setitem__(data, name, value)
+    keys = split_path(name)
+    sdict = data
+    for key in keys[:-1]:
+        if not dict.__contains__(sdict, key):
+            dict.__setitem__(sdict, key, {})
+        sdict = dict.__getitem__(sdict, key)
+    dict.__setitem__(sdict, keys[-1] if keys else name, value)
+
+
+def join_path(name):
+    """'a/b//c' -> '/a/b/c', the form of the leaf index"""
+    return '/' + '/'.join(split_path(name))
+
+
+def iter_leaf_paths(data, basename='', depth=-1):
+    """'/a/b' paths of the non-dict values of nested dicts, in dict order"""
+    if depth == 0:
+        return
+    for key, val in dict.items(data):
+        keyname = basename + '/' + key
+        if isinstance(val, dict):
+            yield from iter_leaf_paths(val, keyname, depth - 1)
+        else:
+            yield keyname
+
+
+def _index_range(index, path):
+    """slice of the paths under path in the sorted index"""
+    # '/a.b' sorts between '/a' and '/a/b', '0' follows '/'
+    return slice(bisect.bisect_left(index, path + '/'),
+                 bisect.bisect_left(index, path + '0'))
+
+
+def _index_remove(index, path):
+    """remove path and the paths under it from the sorted index"""
+    del index[_index_range(index, path)]
+    pos = bisect.bisect_left(index, path)
+    if pos < len(index) and index[pos] == path:
+        del index[pos]
+
+
+def get_many(data, names, default=NO_DEFAULT):
+    if default == NO_DEFAULT:
+        return [get_path(data, name) for name in names]
+    result = []
+    for name in names:
+        try:
+            result.append(get_path(data, name))
+        except KeyError:
+            result.append(default)
+    return result
+
+
+def set_many(data, items):
+    for name, value in getattr(items, 'items', lambda: items)():
+        set_path(data, name, value)
+
+
 class ExtDict(dict):
     """
     Extended Dict
@@ -92,35 +283,149 @@ class ExtDict(dict):
     """
 
     def __getitem__(self, name):
-        if name in self.keys() or not isinstance(name, str):
-            return dict.__getitem__(self, name)
-        name = name.split('/')
-        sdict = self
-        while name:
-            key = name.pop(0)
-            if not key:
-                continue
-            if not key in sdict.keys():
-                raise KeyError('{0} not exist'.format(key))
-            sdict = sdict[key]
+        if not isinstance(name, str) or dict.__contains__(self, name):
+            return self._share(dict.__getitem__(self, name))
+        sdict = get_path(self, name)
         if isinstance(sdict, dict):
-            sdict = ExtDict(sdict)
+            # a copy, but the dicts nested in it are shared
+            sdict = self._share(ExtDict(sdict))
         return sdict
 
     def __setitem__(self, name, value):
-        if name in self.keys() or not isinstance(name, str):
-            return dict.__setitem__(self, name, value)
-        name = name.split('/')
-        sdict = self
-        while name[:-1]:
-            key = name.pop(0)
-            if not key:
-                continue
-            if not key in sdict.keys():
-                sdict[key] = {}
-            sdict = sdict[key]
-        key = name.pop(0)
-        sdict[key] = value
+        set_path(self, name, value)
+        self._update_leaf_index(name, value)
+
+    def view(self, name=None):
+        """ExtDictView of the nested dict at name, no copy"""
+        if name is None:
+            return ExtDictView(self, self, '')
+        return ExtDictView(get_path(self, name), self, name)
+
+    def get_many(self, names, default=NO_DEFAULT):
+        """values of all names, nested dicts are not copied"""
+        values = get_many(self, names, default)
+        for value in values:
+            self._share(value)
+        return values
+
+    def set_many(self, items):
+        """items: dict or iterable of (name, value)"""
+        for name, value in getattr(items, 'items', lambda: items)():
+            self[name] = value
+
+    # sorted '/a/b' paths of all leaves, built on first use and kept up to
+    # date by the ExtDict setters and views. Once a nested dict was handed
+    # out by reference (x['calc_arrays'], get, items, ...) it may change
+    # unseen, from then on the index is rebuilt for every query.
+    def _leaf_index(self):
+        index = self.__dict__.get('_leaf_paths')
+        if index is None or self.__dict__.get('_leaf_shared'):
+            index = sorted(iter_leaf_paths(self))
+            object.__setattr__(self, '_leaf_paths', index)
+        return index
+
+    def _share(self, value):
+        """value handed out by reference, a dict may change unseen"""
+        if isinstance(value, dict):
+            object.__setattr__(self, '_leaf_shared', True)
+        return value
+
+    def _share_values(self):
+        for value in dict.values(self):
+            if isinstance(value, dict):
+                return self._share(value)
+
+    def get(self, name, default=None):
+        return self._share(dict.get(self, name, default))
+
+    def values(self):
+        self._share_values()
+        return dict.values(self)
+
+    def items(self):
+        self._share_values()
+        return dict.items(self)
+
+    def copy(self):
+        self._share_values()
+        return dict.copy(self)
+
+    def _update_leaf_index(self, name, value):
+        index = self.__dict__.get('_leaf_paths')
+        if index is None or self.__dict__.get('_leaf_shared'):
+            return
+        if not isinstance(name, str):
+            return self.rebuild_leaf_index()
+        path = join_path(name)
+        _index_remove(index, path)
+        if not isinstance(value, dict):
+            bisect.insort(index, path)
+            return
+        for leaf in iter_leaf_paths(value, path):
+            bisect.insort(index, leaf)
+
+    def rebuild_leaf_index(self):
+        self.__dict__.pop('_leaf_paths', None)
+
+    # the other dict methods changing keys drop the index
+    def __delitem__(self, name):
+        self.rebuild_leaf_index()
+        dict.__delitem__(self, name)
+
+    def update(self, *args, **kwargs):
+        self.rebuild_leaf_index()
+        dict.update(self, *args, **kwargs)
+
+    def pop(self, *args):
+        self.rebuild_leaf_index()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.rebuild_leaf_index()
+        return dict.popitem(self)
+
+    def clear(self):
+        self.rebuild_leaf_index()
+        dict.clear(self)
+
+    def setdefault(self, *args):
+        self.rebuild_leaf_index()
+        return self._share(dict.setdefault(self, *args))
+
+    def __getstate__(self):
+        # copies and pickles rebuild their own index, shallow copies share
+        # the nested dicts
+        if any(isinstance(value, dict) for value in dict.values(self)):
+            return {'_leaf_shared': True}
+        return None
+
+    def keys_under(self, prefix='/'):
+        """
+        sorted leaf paths under prefix
+        >>> x = ExtDict({'calc_arrays': {'a': 1}, 'b': 2})
+        >>> x.keys_under('/calc_arrays')
+        ['/calc_arrays/a']
+        """
+        index = self._leaf_index()
+        if not split_path(prefix):
+            return list(index)
+        path = join_path(prefix)
+        pos = bisect.bisect_left(index, path)
+        if pos < len(index) and index[pos] == path:
+            return [path]
+        return index[_index_range(index, path)]
+
+    def to_flat_arrays(self, prefix='/'):
+        """{'/a/b': np.ndarray} of all leaves under prefix"""
+        result = dict()
+        for path in self.keys_under(prefix):
+            value = get_path(self, path)
+            try:
+                result[path] = np.asarray(value)
+            except ValueError:
+                # ragged sequences
+                result[path] = np.asarray(value, dtype=object)
+        return result
 
     def __getattr__(self, name):
         if name.startswith('__'):
@@ -137,7 +442,7 @@ class ExtDict(dict):
             def setter(value):
                 self[name] = value
             return setter
-        return dict.__getitem__(self, name)
+        return self._share(dict.__getitem__(self, name))
 
     def __setattr__(self, name, value):
         self[name] = value
@@ -150,16 +455,7 @@ class ExtDict(dict):
             return False
 
     def get_all_keys(self, basename='', depth=10000):
-        result = []
-        if depth == 0:
-            return result
-        for key, val in self.items():
-            keyname = basename+'/'+key
-            if isinstance(val, dict):
-                result += ExtDict.get_all_keys(val, keyname, depth-1)
-            else:
-                result.append(keyname)
-        return result
+        return list(iter_leaf_paths(self, basename, depth))
 
     # def get(self, key, default=NO_DEFAULT):
     #     if key == 'defines' :
@@ -169,3 +465,64 @@ class ExtDict(dict):
     #     elif default != NO_DEFAULT:
     #         return default
     #     raise KeyError(key, 'not found')
+
+
+class ExtDictView(MutableMapping):
+    """
+    '/a/b/c' access into a dict by reference, writes go to the dict
+
+    >>> view = ExtDict({'calc_arrays': {'command': 'x'}}).view('calc_arrays')
+    >>> view['command'] = 'y'
+    """
+
+    __slots__ = ('data', 'root', 'prefix')
+
+    def __init__(self, data, root=None, prefix=''):
+        self.data = data
+        # ExtDict whose leaf index is updated by writes
+        self.root = root
+        self.prefix = prefix
+
+    def __getitem__(self, name):
+        sdict = get_path(self.data, name)
+        if isinstance(sdict, dict):
+            sdict = ExtDictView(sdict, self.root, self._root_path(name))
+        return sdict
+
+    def _root_path(self, name):
+        if not isinstance(name, str):
+            return None
+        return None if self.prefix is None else self.prefix + '/' + name
+
+    def __setitem__(self, name, value):
+        set_path(self.data, name, value)
+        if self.root is not None:
+            path = self._root_path(name)
+            if path is None:
+                self.root.rebuild_leaf_index()
+            else:
+                self.root._update_leaf_index(path, value)
+
+    def __delitem__(self, name):
+        del self.data[name]
+        if self.root is not None:
+            self.root.rebuild_leaf_index()
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.data)
+
+    def view(self, name=None):
+        return self if name is None else self[name]
+
+    def get_many(self, names, default=NO_DEFAULT):
+        return get_many(self.data, names, default)
+
+    def set_many(self, items):
+        for name, value in getattr(items, 'items', lambda: items)():
+            self[name] = value
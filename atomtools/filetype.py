@@ -5,10 +5,14 @@ analyze chemical input/output filetype
 
 import os
 import re
+import hashlib
 import argparse
+import itertools
 import configparser
+import multiprocessing
 import modlog
 from . import fileutil
+from . import system
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,11 +22,30 @@ DEFAULT_FILETYPE_REGEXP_CONF = os.path.join(
 REG_ANYSTRING = r'[\s\S]*?'
 FILETYPE_SECTION_NAME = 'filetype'
 MULTIFRAME_NAME = 'multiframe'
+FRAMEBOUNDARY_NAME = 'frameboundary'
+STATUS_NAME = 'status'
 
 logger = modlog.getLogger(__name__)
 
 global FORMATS_REGEXP, MULTIFRAME
 FORMATS_REGEXP, MULTIFRAME = dict(), list()
+# filetype -> regexp of the head of its frames, see frameindex
+FRAME_BOUNDARY = dict()
+# filetype -> 'complete regexp && error regexp', see status.StatusMonitor
+STATUS_REGEXP = dict()
+# FORMATS_REGEXP compiled by update_config:
+#   RULES: [(name_regexp, content_regexp or None, filetype)] in config order
+#   RULES_BY_EXTENSION: literal extension ('.log') -> indices of the rules
+#       whose name regexp only matches names containing it
+#   GENERIC_RULES: indices of the rules which can not be indexed
+RULES, RULES_BY_EXTENSION, GENERIC_RULES = list(), dict(), list()
+# hash of FORMATS_REGEXP, part of the filetype cache key
+CONFIG_HASH = None
+# persistent filetype cache, see set_cache
+CACHE = None
+CACHE_ENV_NAME = 'ATOMTOOLS_FILETYPE_CACHE'
+# a name regexp alternative as .*\.ext or .*\.ext$
+EXTENSION_REGEXP = re.compile(r'^\.\*\\(\.[\w-]+)\$?$')
 
 PARTIAL_LENGTH = 100000
 
@@ -36,48 +59,237 @@ def update_config(path=None):
         conf.read(path)
         FORMATS_REGEXP.update(conf._sections[FILETYPE_SECTION_NAME])
         MULTIFRAME += conf._sections[MULTIFRAME_NAME][MULTIFRAME_NAME].split()
+        FRAME_BOUNDARY.update(conf._sections.get(FRAMEBOUNDARY_NAME, {}))
+        STATUS_REGEXP.update(conf._sections.get(STATUS_NAME, {}))
+    compile_rules()
 
 
-def filetype(fileobj=None, is_filename=True):
+def _name_extensions(name_regexp):
+    """
+    literal extensions one of which a filename has to contain to match
+    name_regexp, None if name_regexp is not a plain list of extensions
+    """
+    extensions = []
+    for alternative in name_regexp.split('|'):
+        res = EXTENSION_REGEXP.match(alternative.strip())
+        if not res:
+            return None
+        extensions.append(res[1])
+    return extensions
+
+
+def _content_pattern(content_regexp):
+    """
+    content regexp wrapped in REG_ANYSTRING unless anchored by ^/$,
+    to be used with re.match
+    """
+    if not content_regexp.startswith('^'):
+        content_regexp = REG_ANYSTRING + content_regexp.strip()
+    if not content_regexp.endswith('$'):
+        content_regexp = content_regexp.strip() + REG_ANYSTRING
+    return content_regexp.strip()
+
+
+def compile_rules():
+    """
+    compile every rule of FORMATS_REGEXP once and index them by extension
+    """
+    global CONFIG_HASH
+    CONFIG_HASH = hashlib.sha1(
+        repr(list(FORMATS_REGEXP.items())).encode()).hexdigest()
+    del RULES[:], GENERIC_RULES[:]
+    RULES_BY_EXTENSION.clear()
+    for fmt_regexp, fmt_filetype in FORMATS_REGEXP.items():
+        name_regexp, content_regexp = (fmt_regexp.split('&&') + [None])[:2]
+        try:
+            rule = (re.compile(name_regexp.strip()),
+                    re.compile(_content_pattern(content_regexp))
+                    if content_regexp else None,
+                    fmt_filetype)
+        except re.error as err:
+            logger.warning(f"skip rule {fmt_regexp} = {fmt_filetype}: {err}")
+            continue
+        extensions = _name_extensions(name_regexp)
+        if extensions is None:
+            GENERIC_RULES.append(len(RULES))
+        for extension in extensions or []:
+            RULES_BY_EXTENSION.setdefault(extension, []).append(len(RULES))
+        RULES.append(rule)
+
+
+def match_rule(rule, filename, content):
+    """whether filename and content match rule of RULES"""
+    name_regexp, content_regexp, _ = rule
+    logger.debug(f"{name_regexp.pattern}, {content_regexp}")
+    if filename is not None and not name_regexp.match(filename):
+        return False
+    if content and content_regexp:
+        return content_regexp.match(content) is not None
+    return True
+
+
+def candidate_rules(filename):
+    """indices of the rules that may match filename, in config order"""
+    if filename is None:
+        return range(len(RULES))
+    candidates = set(GENERIC_RULES)
+    lengths = set(len(x) for x in RULES_BY_EXTENSION)
+    pos = filename.find('.')
+    while pos != -1:
+        for length in lengths:
+            candidates.update(
+                RULES_BY_EXTENSION.get(filename[pos:pos+length], []))
+        pos = filename.find('.', pos + 1)
+    return sorted(candidates)
+
+
+def set_cache(path=None):
+    """
+    enable the persistent filetype cache at path (default
+    filetype_cache.DEFAULT_CACHE_PATH), or disable it if path is False.
+    The cache is also enabled by the ATOMTOOLS_FILETYPE_CACHE environment
+    variable, set to a path or 1 for the default path.
+    """
+    global CACHE
+    from .filetype_cache import FiletypeCache
+    if CACHE is not None:
+        CACHE.close()
+    CACHE = FiletypeCache(path or None) if path is not False else None
+    return CACHE
+
+
+def _cache_config(size):
+    return f'{CONFIG_HASH}:{size or PARTIAL_LENGTH}'
+
+
+def filetype(fileobj=None, is_filename=True, size=None, cache=None):
     """
     >>> filetype("a.gjf")
     gaussian
     >>> filetype("1.gro")
     gromacs
+
+    size: read only the first size bytes, default PARTIAL_LENGTH
+    cache: FiletypeCache to use for filenames, default the one of
+        set_cache, False to skip it
     """
+    cache = CACHE if cache is None else cache
+    if cache and isinstance(fileobj, str) and is_filename:
+        key = cache.get_key(fileobj)
+        if key is not None:
+            hit, ftype = cache.get(fileobj, _cache_config(size), key)
+            if not hit:
+                ftype = _filetype(fileobj, is_filename, size)
+                cache.set(fileobj, ftype, _cache_config(size), key)
+            return ftype
+    return _filetype(fileobj, is_filename, size)
+
+
+def _filetype(fileobj=None, is_filename=True, size=None):
     filename = fileutil.get_absfilename(fileobj)
     if fileutil.is_compressed_file(filename):
-        fileobj = fileutil.get_uncompressed_fileobj(filename)
+        # only the head is decompressed, in memory
+        fileobj = fileutil.get_uncompressed_fileobj(
+            filename, size=size or PARTIAL_LENGTH)
         filename = fileutil.get_uncompressed_filename(filename)
+        is_filename = False
     else:
         filename = fileutil.get_filename(fileobj)
     content = None
     try:
         content = fileutil.get_file_content(
-            fileobj, size=PARTIAL_LENGTH, is_filename=is_filename)
+            fileobj, size=size or PARTIAL_LENGTH, is_filename=is_filename)
     except TypeError:
         pass
     if filename is None and content is None:
         return None
     logger.debug("filename: %s, content: %s" % (filename, content))
-    for fmt_regexp, fmt_filetype in FORMATS_REGEXP.items():
-        name_regexp, content_regexp = (fmt_regexp.split('&&') + [None])[:2]
-        logger.debug(f"{name_regexp}, {content_regexp}")
-        if filename and re.match(re.compile(name_regexp.strip()), filename) or filename is None:
-            if content and content_regexp:
-                if not content_regexp.startswith('^'):
-                    content_regexp = REG_ANYSTRING + content_regexp.strip()
-                if not content_regexp.endswith('$'):
-                    content_regexp = content_regexp.strip() + REG_ANYSTRING
-                logger.debug("content_regexp: " + content_regexp)
-                if re.match(re.compile(content_regexp.strip()), content):
-                    return fmt_filetype
-            else:
-                return fmt_filetype
+    for index in candidate_rules(filename):
+        if match_rule(RULES[index], filename, content):
+            return RULES[index][2]
     logger.warning(f"filename: {filename} parse fail")
     return None
 
 
+def iter_files(paths, recursive=True):
+    """all files in paths, directories are walked if recursive"""
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        if os.path.isdir(path):
+            if not recursive:
+                for entry in os.scandir(path):
+                    if entry.is_file():
+                        yield entry.path
+                continue
+            for dirpath, _, filenames in os.walk(path):
+                for filename in filenames:
+                    yield os.path.join(dirpath, filename)
+        elif os.path.isfile(path):
+            yield path
+
+
+def _scan_filetype(args):
+    filename, size = args
+    try:
+        return filename, filetype(filename, size=size, cache=False)
+    except Exception as err:
+        logger.warning(f"filename: {filename} failed: {err}")
+        return filename, None
+
+
+SCAN_BATCH_SIZE = 4096
+
+
+def scan_filetypes(paths, nprocs=None, size=None, recursive=True,
+                   chunksize=64, cache=None):
+    """
+    classify all files under paths with a process pool
+        input:
+            paths: filename/directory or a list of them
+            nprocs: number of processes, default the cores of the
+                allocation (system.get_cpu_limit), 1 runs serially
+            size: read only the first size bytes of every file
+            cache: see filetype, looked up and updated in this process,
+                only the missing files are sent to the pool
+        output:
+            generator of (filename, filetype) in order of completion
+    """
+    cache = CACHE if cache is None else cache
+    nprocs = nprocs or system.get_cpu_limit()
+    pool = multiprocessing.Pool(nprocs) if nprocs > 1 else None
+    config = _cache_config(size)
+    filenames = iter_files(paths, recursive)
+    try:
+        while True:
+            batch = list(itertools.islice(filenames, SCAN_BATCH_SIZE))
+            if not batch:
+                break
+            keys = {}
+            if cache:
+                misses = []
+                for filename in batch:
+                    keys[filename] = key = cache.get_key(filename)
+                    hit, ftype = cache.get(filename, config, key)
+                    if hit:
+                        yield filename, ftype
+                    else:
+                        misses.append(filename)
+                batch = misses
+            tasks = [(filename, size) for filename in batch]
+            results = pool.imap_unordered(_scan_filetype, tasks, chunksize) \
+                if pool else map(_scan_filetype, tasks)
+            done = []
+            for filename, ftype in results:
+                done.append((filename, ftype, keys.get(filename)))
+                yield filename, ftype
+            if cache:
+                cache.set_many(done, config)
+    finally:
+        if pool:
+            pool.terminate()
+
+
 def list_supported_formats():
     return list(FORMATS_REGEXP.values())
 
@@ -89,6 +301,9 @@ def support_multiframe(ftype):
 
 
 update_config()
+if os.environ.get(CACHE_ENV_NAME):
+    set_cache(None if os.environ[CACHE_ENV_NAME] == '1'
+              else os.environ[CACHE_ENV_NAME])
 
 
 if __name__ == '__main__':
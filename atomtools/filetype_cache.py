@@ -0,0 +1,105 @@
+"""
+persistent cache of filetype results
+
+results are keyed by the realpath of the file, its size and mtime and a
+hash of the filetype rules, so that changed files or changed rules
+(default_filetype.conf or update_config) are detected automatically
+"""
+
+
+import os
+import sqlite3
+import threading
+import modlog
+
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'atomtools', 'filetype.sqlite')
+SQLITE_TIMEOUT = 30
+
+logger = modlog.getLogger(__name__)
+
+
+class FiletypeCache(object):
+    """
+    sqlite based filetype cache
+
+    >>> with open('a.gjf', 'w') as fd:
+    ...     _ = fd.write('#p opt')
+    >>> cache = FiletypeCache('filetype.sqlite')
+    >>> cache.set('a.gjf', 'gaussian', 'rules-hash')
+    >>> cache.get('a.gjf', 'rules-hash')
+    (True, 'gaussian')
+    >>> cache.get('a.gjf', 'other-rules-hash')
+    (False, None)
+    >>> cache.get('missing.gjf', 'rules-hash')  # only files are cached
+    (False, None)
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_CACHE_PATH
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS filetype ('
+                          'path TEXT PRIMARY KEY, size INTEGER, '
+                          'mtime INTEGER, config TEXT, filetype TEXT)')
+        self.conn.commit()
+
+    @staticmethod
+    def get_key(filename):
+        """(realpath, size, mtime_ns) of filename, None if not a file"""
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return os.path.realpath(filename), stat.st_size, stat.st_mtime_ns
+
+    def get(self, filename, config, key=None):
+        """
+        output:
+            (hit, filetype), hit is False if there is no valid entry
+        """
+        key = key or self.get_key(filename)
+        if key is None:
+            return False, None
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT size, mtime, config, filetype FROM filetype '
+                'WHERE path = ?', (key[0],)).fetchone()
+        if row is None or tuple(row[:3]) != (key[1], key[2], config):
+            return False, None
+        return True, row[3]
+
+    def set(self, filename, ftype, config, key=None):
+        self.set_many([(filename, ftype, key)], config)
+
+    def set_many(self, items, config):
+        """items: (filename, filetype) or (filename, filetype, key)"""
+        rows = []
+        for item in items:
+            filename, ftype = item[:2]
+            key = (item[2] if len(item) > 2 else None) or \
+                self.get_key(filename)
+            if key is not None:
+                rows.append(key + (config, ftype))
+        try:
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO filetype '
+                    '(path, size, mtime, config, filetype) '
+                    'VALUES (?, ?, ?, ?, ?)', rows)
+        except sqlite3.OperationalError as err:
+            logger.warning(f"filetype cache {self.path} not updated: {err}")
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM filetype')
+
+    def close(self):
+        self.conn.close()
@@ -13,16 +13,28 @@ extension is a string ".xxxx"
 
 
 import os
-import shutil
+import io
+import bz2
+import gzip
+import lzma
+import mmap
+import shlex
+import re
 import time
+import zipfile
+import tempfile
+import subprocess
 from io import StringIO
 import chardet
-from .name import randString
 
 
 MAX_FILENAME_LENGTH = 200
 MAX_DETECT_LENGTH = 300000
+# bytes given to chardet when the content is not valid UTF-8
+CHARDET_SAMPLE_LENGTH = 8192
 MAX_ACTIVE_TIME = 3600
+# encoding used for every file if set, None to detect it
+DEFAULT_ENCODING = None
 
 
 def get_file_extension(filename):
@@ -37,26 +49,89 @@ def get_file_basename(filename):
     return None
 
 
-def get_file_content(fileobj, size=-1, is_filename=False):
+def _read_bytes(filename, size=-1):
+    with open(filename, 'rb') as fd:
+        return fd.read(size)
+
+
+def _utf8_error(data):
+    """None if data is UTF-8 (possibly cut inside the last character)"""
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError as err:
+        if err.reason == 'unexpected end of data' and \
+                len(data) - err.start < 4:
+            return None
+        return err
+    return None
+
+
+def detect_encoding(data):
+    """
+    encoding of data: UTF-8 (and ASCII) is validated at C speed, chardet
+    only sees CHARDET_SAMPLE_LENGTH bytes around the first invalid byte
+    """
+    err = _utf8_error(data)
+    if err is None:
+        return 'utf-8'
+    start = max(0, err.start - CHARDET_SAMPLE_LENGTH // 2)
+    sample = data[start:start + CHARDET_SAMPLE_LENGTH]
+    return chardet.detect(sample)['encoding'] or 'latin-1'
+
+
+def decode_bytes(data, encoding=None):
+    """
+    decode data with encoding, default DEFAULT_ENCODING or detected,
+    undecodable bytes fall back to latin-1
+    """
+    encoding = encoding or DEFAULT_ENCODING
+    if encoding is None:
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            encoding = detect_encoding(data)
+    # a UTF-8 head may end inside a character
+    errors = 'replace' if encoding == 'utf-8' else 'strict'
+    try:
+        return data.decode(encoding, errors=errors)
+    except (UnicodeDecodeError, LookupError):
+        return data.decode('latin-1')
+
+
+def _strip_cr(content):
+    # avoid copying large contents without any \r
+    return content.replace('\r', '') if '\r' in content else content
+
+
+def get_file_content(fileobj, size=-1, is_filename=False, encoding=None,
+                     binary=False):
     """
     get content of fileobj
+        input:
+            encoding: pin the encoding instead of detecting it
+            binary: return the raw bytes of files, \r kept
     """
     if is_filename:
         if os.path.isfile(fileobj):
-            with open(fileobj, 'rb') as fd:
-                data = fd.read(size)
-            code = chardet.detect(data[:MAX_DETECT_LENGTH])['encoding']
-            return data.decode(code).replace('\r', '')
+            data = _read_bytes(fileobj, size)
+            if binary:
+                return data
+            return _strip_cr(decode_bytes(data, encoding))
         return None
     if hasattr(fileobj, 'read'):
         fileobj.seek(0)
-        return fileobj.read().replace('\r', '')
+        content = fileobj.read()
+        if binary:
+            return content
+        if isinstance(content, bytes):
+            content = decode_bytes(content, encoding)
+        return _strip_cr(content)
     elif isinstance(fileobj, str):
         if len(fileobj) < MAX_FILENAME_LENGTH and os.path.exists(fileobj):  # a filename
-            with open(fileobj, 'rb') as fd:
-                data = fd.read(size)
-            code = chardet.detect(data[:MAX_DETECT_LENGTH])['encoding']
-            return data.decode(code).replace('\r', '')
+            data = _read_bytes(fileobj, size)
+            if binary:
+                return data
+            return _strip_cr(decode_bytes(data, encoding))
         else:
             return fileobj
     else:
@@ -64,6 +139,95 @@ def get_file_content(fileobj, size=-1, is_filename=False):
             'fileobj should be filename/filecontent/StringIO object')
 
 
+class MappedFileContent(object):
+    """
+    read-only, memory-mapped content of a file, nothing is read or decoded
+    before it is used
+
+    >>> with MappedFileContent('a.log') as content:
+    ...     match = content.search(rb'SCF Done:.*')
+    ...     text = content.decode(match.start(), match.end())
+    """
+
+    def __init__(self, filename, encoding=None):
+        self.filename = filename
+        self._encoding = encoding or DEFAULT_ENCODING
+        self._fd = open(filename, 'rb')
+        size = os.fstat(self._fd.fileno()).st_size
+        # zero-length files cannot be mapped
+        self.data = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ) \
+            if size else b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._fd.close()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    @property
+    def encoding(self):
+        """detected from the head of the file on first use"""
+        if self._encoding is None:
+            self._encoding = detect_encoding(self.data[:MAX_DETECT_LENGTH])
+        return self._encoding
+
+    def find(self, sub, start=0, end=None):
+        return self.data.find(sub, start, len(self) if end is None else end)
+
+    def search(self, pattern, pos=0, endpos=None):
+        """regex search over the bytes, pattern is bytes or compiled"""
+        endpos = len(self) if endpos is None else endpos
+        return re.compile(pattern).search(self.data, pos, endpos)
+
+    def finditer(self, pattern, pos=0, endpos=None):
+        endpos = len(self) if endpos is None else endpos
+        return re.compile(pattern).finditer(self.data, pos, endpos)
+
+    def _char_boundary(self, pos):
+        # move pos off UTF-8 continuation bytes
+        if self.encoding.lower().replace('-', '') == 'utf8':
+            while 0 < pos < len(self) and 0x80 <= self.data[pos] < 0xC0:
+                pos += 1
+        return pos
+
+    def decode(self, start=0, end=None):
+        """text of the bytes [start:end], aligned to characters, \r removed"""
+        end = len(self) if end is None else min(end, len(self))
+        start, end = self._char_boundary(start), self._char_boundary(end)
+        return _strip_cr(self.data[start:end].decode(self.encoding,
+                                                     errors='replace'))
+
+    def iter_windows(self, size=2**24):
+        """decoded text in windows of about size bytes, split at newlines"""
+        start = 0
+        while start < len(self):
+            end = self.find(b'\n', start + size) + 1 or len(self)
+            yield self.decode(start, end)
+            start = end
+
+    def iter_lines(self, start=0, end=None, decode=True):
+        """lines without line endings, bytes if not decode"""
+        end = len(self) if end is None else end
+        while start < end:
+            stop = self.find(b'\n', start, end)
+            stop = end if stop < 0 else stop
+            line = self.data[start:stop].rstrip(b'\r')
+            yield line.decode(self.encoding, errors='replace') \
+                if decode else line
+            start = stop + 1
+
+
 def get_absfilename(fileobj):
     if hasattr(fileobj, 'read'):
         return os.path.realpath(fileobj.name) if hasattr(fileobj, 'name') else None
@@ -97,8 +261,8 @@ def get_extension(fileobj):
 
 
 def get_time_since_lastmod(filename):
-    filename = get_filename(filename)
-    if not os.path.exists(filename):
+    filename = get_absfilename(filename)
+    if filename is None or not os.path.exists(filename):
         return 0
     return time.time() - os.stat(filename).st_mtime
 
@@ -112,54 +276,155 @@ def file_active(filename):
 
 
 def file_exist(filename):
-    filename = get_filename(filename)
+    filename = get_absfilename(filename)
     if filename is None:
         return False
     return os.path.exists(filename)
 
 
+def _open_zip(filename, mode='rb'):
+    """first member of a zip archive, readable after the archive closes"""
+    with zipfile.ZipFile(filename) as archive:
+        names = [x for x in archive.namelist() if not x.endswith('/')]
+        if not names:
+            raise ValueError(f'{filename} is an empty zip archive')
+        return archive.open(names[0])
+
+
+# in-process streaming decompression
+compress_opener = {
+    '.gz': gzip.open,
+    '.xz': lzma.open,
+    '.lzma': lzma.open,
+    '.bz2': bz2.open,
+    '.bz': bz2.open,
+    '.zip': _open_zip,
+}
+# formats without a standard library module, decompressed to stdout
 compress_command = {
-    '.xz': 'xz -d -f',
-    '.zip': 'unzip',
-    '.gz': 'gzip -d ',
-    '.Z': 'uncompress',
-    '.bz2': 'bzip2 -d',
-    '.bz': 'bzip2 -d',
-    '.rar': 'rar x',
-    '.lha': 'lha -e',
+    '.Z': 'uncompress -c',
+    '.rar': 'unrar p -inul',
+    '.lha': 'lha -pq',
 }
+# seconds a closed command stream may take to exit before it is killed
+COMMAND_CLOSE_TIMEOUT = 10
 
 
-def get_uncompressed_fileobj(filename):
-    import gzip
-    tmpdir = '/tmp/atomtools_{0}'.format(randString())
-    absfilename = get_absfilename(filename)
-    extension = get_file_extension(absfilename)
-    if not extension in compress_command:
-        return filename
+class _CommandStream(io.RawIOBase):
+    """
+    stdout of a decompression command; reading to the end raises OSError
+    if the command failed, close waits for the command (no zombies)
+    """
 
-    # if extension == '.gz':
-    #     import pdb; pdb.set_trace()
-    #     res = gzip.GzipFile(filename, 'rb')
-    #     res = StringIO(res.read())
-
-    cmd = compress_command[extension]
-    if not os.path.exists(tmpdir):
-        os.makedirs(tmpdir)
-    tmpfilename = os.path.join(tmpdir, os.path.basename(absfilename))
-    newfilename = os.path.splitext(tmpfilename)[0]
-    shutil.copyfile(os.path.abspath(absfilename), tmpfilename)
-    cmd += ' ' + tmpfilename + \
-        '; dos2unix {0} > /dev/null 2>&1 '.format(newfilename)
-    os.system(cmd)
-    with open(newfilename) as fd:
-        fileobj = StringIO(fd.read())
-        fileobj.name = os.path.basename(newfilename)
-    os.remove(newfilename)
-    try:
-        shutil.rmtree(tmpdir)
-    except:
-        pass
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                         stderr=self._stderr)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self._process.stdout.readinto(buffer)
+        if not size and self._process.wait():
+            self._stderr.seek(0)
+            raise OSError('{0} exited with {1}: {2}'.format(
+                ' '.join(self.cmd), self._process.returncode,
+                self._stderr.read().decode(errors='replace').strip()))
+        return size
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        # closed before the end, the command stops on a broken pipe
+        self._process.stdout.close()
+        try:
+            self._process.wait(COMMAND_CLOSE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._stderr.close()
+
+
+class _PrefixedStream(io.RawIOBase):
+    """head bytes already read from fileobj, followed by the rest of it"""
+
+    def __init__(self, head, fileobj):
+        self._head = memoryview(head)
+        self._fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._head:
+            size = min(len(buffer), len(self._head))
+            buffer[:size] = self._head[:size]
+            self._head = self._head[size:]
+            return size
+        return self._fileobj.readinto(buffer)
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self._fileobj.close()
+
+
+def open_uncompressed(filename, mode='rb', encoding=None):
+    """
+    open a (compressed) file as a stream of its uncompressed content,
+    nothing is decompressed before it is read
+        input:
+            mode: 'rb' or 'rt'
+            encoding: for 'rt', default detected from the first bytes
+        output:
+            file-like object
+    """
+    extension = get_file_extension(filename)
+    if extension in compress_opener:
+        fileobj = compress_opener[extension](filename, 'rb')
+    elif extension in compress_command:
+        cmd = shlex.split(compress_command[extension]) + [filename]
+        fileobj = io.BufferedReader(_CommandStream(cmd))
+    else:
+        fileobj = open(filename, 'rb')
+    if 'b' in mode:
+        return fileobj
+    encoding = encoding or DEFAULT_ENCODING
+    if encoding is None:
+        # the head is detected once and then read again from memory
+        head = fileobj.read(MAX_DETECT_LENGTH)
+        encoding = detect_encoding(head)
+        fileobj = io.BufferedReader(_PrefixedStream(head, fileobj))
+    return io.TextIOWrapper(fileobj, encoding=encoding, errors='replace')
+
+
+def read_uncompressed(filename, size=-1):
+    """first size bytes of the uncompressed content, all if size < 0"""
+    with open_uncompressed(filename) as fileobj:
+        return fileobj.read(size)
+
+
+def iter_uncompressed_lines(filename, encoding=None):
+    """iterate over the lines of a (compressed) file without loading it"""
+    with open_uncompressed(filename, 'rt', encoding) as fileobj:
+        yield from fileobj
+
+
+def get_uncompressed_fileobj(filename, size=-1):
+    """
+    StringIO with the first size bytes of the uncompressed content, its
+    name is the filename without the compression extension
+    """
+    extension = get_file_extension(filename)
+    if extension not in compress_opener and \
+            extension not in compress_command:
+        return filename
+    fileobj = StringIO(_strip_cr(decode_bytes(
+        read_uncompressed(filename, size))))
+    fileobj.name = os.path.basename(get_uncompressed_filename(filename))
     return fileobj
 
 
@@ -168,6 +433,9 @@ def get_uncompressed_filename(filename):
 
 
 def is_compressed_file(filename):
-    if os.path.exists(filename) and get_file_extension(filename) in compress_command:
+    extension = get_file_extension(filename)
+    if not filename or not os.path.exists(filename):
+        return False
+    if extension in compress_opener or extension in compress_command:
         return True
     return False
@@ -0,0 +1,190 @@
+"""
+byte-offset index of the frames of multiframe files
+
+the head of every frame is matched by the [frameboundary] regexps of
+default_filetype.conf, the offsets are saved next to the file as
+<filename>.fidx.npz and reused while the file is unchanged
+"""
+import os
+import re
+import numpy as np
+
+import modlog
+from . import filetype
+from . import fileutil
+
+
+FRAME_INDEX_SUFFIX = '.fidx.npz'
+# smallest block searched for the newlines of a frame
+MIN_BLOCK_SIZE = 4096
+
+
+logger = modlog.getLogger(__name__)
+
+
+def get_frame_boundary(ftype):
+    if ftype not in filetype.FRAME_BOUNDARY:
+        raise NotImplementedError(f'no frame boundary for filetype {ftype}')
+    return re.compile(filetype.FRAME_BOUNDARY[ftype].encode(), re.MULTILINE)
+
+
+def _skip_lines(array, pos, nlines, block_size):
+    """position after the nlines-th newline from pos, None if not there"""
+    if nlines <= 0:
+        return pos
+    while pos < len(array):
+        newlines = np.flatnonzero(array[pos:pos + block_size] == 10)
+        if len(newlines) >= nlines:
+            return pos + int(newlines[nlines - 1]) + 1
+        nlines -= len(newlines)
+        pos += block_size
+        block_size *= 2
+    return None
+
+
+def build_frame_offsets(content, boundary):
+    """
+    input:
+        content: fileutil.MappedFileContent or bytes
+        boundary: compiled bytes regexp of the head of a frame
+    output:
+        int64 array of the nframes + 1 frame offsets, the last is the size
+    """
+    data = getattr(content, 'data', content)
+    size = len(data)
+    offsets = []
+    has_natoms = 'natoms' in boundary.groupindex
+    array = np.frombuffer(data, dtype=np.uint8) if has_natoms else None
+    block_size = MIN_BLOCK_SIZE
+    pos = 0
+    while pos < size:
+        match = boundary.match(data, pos) if offsets else None
+        match = match or boundary.search(data, pos)
+        if match is None:
+            break
+        offsets.append(match.start())
+        if not has_natoms:
+            # the next frame starts at the next match
+            pos = max(match.end(), match.start() + 1)
+            continue
+        natoms = int(match.group('natoms'))
+        end = _skip_lines(array, match.end(), natoms + 1, block_size)
+        if end is None:
+            logger.warning(f'last frame at {match.start()} is truncated')
+            break
+        block_size = max(MIN_BLOCK_SIZE, int((end - match.start()) * 1.1))
+        pos = end
+    del array
+    offsets.append(size)
+    return np.array(offsets, dtype=np.int64)
+
+
+class FrameIndex(object):
+    """
+    frame offsets of a multiframe file for random access and chunked
+    parsing
+
+    >>> index = FrameIndex('traj.xyz')
+    >>> len(index)
+    10000
+    >>> frame = index.read_frame(9000)
+    >>> chunks = index.chunks(8)  # (frame_start, frame_stop, start, stop)
+    """
+
+    def __init__(self, filename, ftype=None, persist=True):
+        self.filename = filename
+        self.ftype = ftype or filetype.filetype(filename)
+        if not filetype.support_multiframe(self.ftype):
+            raise NotImplementedError(f'{self.ftype} is not multiframe')
+        self.boundary = get_frame_boundary(self.ftype)
+        self.index_filename = filename + FRAME_INDEX_SUFFIX
+        # signature of the indexed content
+        self.signature = None
+        self.offsets = self.load() if persist else None
+        if self.offsets is None:
+            # taken before the file is read, so appends while indexing
+            # make it stale instead of being saved with truncated offsets
+            self.signature = self._signature()
+            with fileutil.MappedFileContent(filename) as content:
+                self.offsets = build_frame_offsets(content, self.boundary)
+            if persist:
+                self.save()
+
+    def _signature(self):
+        stat = os.stat(self.filename)
+        return stat.st_size, stat.st_mtime_ns, self.boundary.pattern
+
+    def load(self):
+        """offsets of a valid saved index, None if missing or stale"""
+        if not os.path.exists(self.index_filename):
+            return None
+        try:
+            with np.load(self.index_filename) as saved:
+                signature = (int(saved['size']), int(saved['mtime_ns']),
+                             bytes(saved['pattern']))
+                offsets = saved['offsets']
+                if signature != self._signature() or \
+                        int(offsets[-1]) != signature[0]:
+                    return None
+                self.signature = signature
+                return offsets
+        except (OSError, KeyError, ValueError) as err:
+            logger.warning(f'{self.index_filename} not loaded: {err}')
+            return None
+
+    def save(self):
+        """save the offsets, unless the file changed since it was indexed"""
+        if self.signature != self._signature() or \
+                int(self.offsets[-1]) != self.signature[0]:
+            logger.warning(f'{self.filename} changed while indexing, '
+                           'index not saved')
+            return
+        size, mtime_ns, pattern = self.signature
+        try:
+            with open(self.index_filename, 'wb') as fd:
+                np.savez(fd, offsets=self.offsets, size=size,
+                         mtime_ns=mtime_ns, pattern=np.void(pattern))
+        except OSError as err:
+            logger.warning(f'{self.index_filename} not saved: {err}')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def frame_range(self, k):
+        """byte range (start, stop) of frame k"""
+        k = range(len(self))[k]
+        return int(self.offsets[k]), int(self.offsets[k + 1])
+
+    def read_frame(self, k, decode=True):
+        """content of frame k, one seek and one read"""
+        start, stop = self.frame_range(k)
+        with open(self.filename, 'rb') as fd:
+            fd.seek(start)
+            data = fd.read(stop - start)
+        if not decode:
+            return data
+        return fileutil.decode_bytes(data).replace('\r', '')
+
+    def iter_frames(self, start=0, stop=None, decode=True):
+        with fileutil.MappedFileContent(self.filename) as content:
+            for k in range(len(self))[start:stop]:
+                frame_start, frame_stop = self.frame_range(k)
+                if decode:
+                    yield content.decode(frame_start, frame_stop)
+                else:
+                    yield content[frame_start:frame_stop]
+
+    def chunks(self, nchunks):
+        """
+        split the frames into nchunks for parallel parsing
+        output:
+            [(frame_start, frame_stop, byte_start, byte_stop), ...]
+        """
+        bounds = np.linspace(0, len(self), min(nchunks, len(self)) + 1)
+        bounds = np.round(bounds).astype(int)
+        return [(int(i), int(j), int(self.offsets[i]), int(self.offsets[j]))
+                for i, j in zip(bounds[:-1], bounds[1:])]
+
+
+def get_frame_index(filename, ftype=None, persist=True):
+    return FrameIndex(filename, ftype, persist)
@@ -39,9 +39,18 @@ def asin(result, arc=False):
 
 
 def get_positions(positions):
+    """
+    (natoms, 3) positions of one frame, trajectories are rejected instead
+    of being flattened into one system
+    """
     if hasattr(positions, 'positions'):
         positions = positions.positions
-    return np.array(positions).reshape((-1, 3))
+    positions = np.array(positions)
+    if positions.ndim > 2:
+        raise ValueError(
+            f'positions of {len(positions)} frames given for one frame, use '
+            'the get_batch_* functions or iterate over the frames')
+    return positions.reshape((-1, 3))
 
 
 def get_atoms_size(positions):
@@ -88,11 +97,294 @@ def get_dihedral(positions, i, j, k, l):
     return acos(v1.dot(v2)) * np.sign(v2.dot(np.cross(v1, vl)))
 
 
+def get_trajectory_positions(positions):
+    """
+    positions of a trajectory as a (nframes, natoms, 3) array without
+    copying, a single frame gives nframes = 1
+
+    The batch functions use these plain Cartesian positions only, the
+    cells and pbc of a periodic trajectory are ignored (no minimum image).
+    Iterate over the frames of a trajectory.Trajectory for the minimum
+    image distances of get_distance_matrix etc.
+    """
+    if hasattr(positions, 'positions'):
+        positions = positions.positions
+    positions = np.asarray(positions, dtype=float)
+    if positions.ndim == 2:
+        positions = positions[np.newaxis]
+    assert positions.ndim == 3 and positions.shape[-1] == 3, \
+        'positions should be (nframes, natoms, 3)'
+    return positions
+
+
+def _batch_normed(v):
+    length = norm(v, axis=-1, keepdims=True)
+    return np.divide(v, length, out=v.copy(), where=length >= EXTREME_SMALL)
+
+
+def _batch_acos(result, arc=False):
+    factor = 1 if arc else 180.0/math.pi
+    return np.arccos(np.clip(result, -1, 1)) * factor
+
+
+def _batch_indices(indices, nindex):
+    indices = np.asarray(indices, dtype=int).reshape((-1, nindex))
+    return [indices[:, i] for i in range(nindex)]
+
+
+def get_batch_distances(positions, indices):
+    """
+    distances of many atom pairs over many frames in one pass
+        input:
+            positions: (nframes, natoms, 3) array or trajectory like object
+            indices: (M, 2) array of atom indices
+        output:
+            (nframes, M) array
+    """
+    positions = get_trajectory_positions(positions)
+    i, j = _batch_indices(indices, 2)
+    return norm(positions[:, i] - positions[:, j], axis=-1)
+
+
+def get_batch_angles(positions, indices, arc=False):
+    """
+    angles i-j-k of (M, 3) indices over all frames, same as get_angle
+        output:
+            (nframes, M) array, in degree unless arc
+    """
+    positions = get_trajectory_positions(positions)
+    i, j, k = _batch_indices(indices, 3)
+    v1 = _batch_normed(positions[:, i] - positions[:, j])
+    v2 = _batch_normed(positions[:, k] - positions[:, j])
+    return _batch_acos(np.sum(v1 * v2, axis=-1), arc)
+
+
+def get_batch_dihedrals(positions, indices, arc=False, standard=False):
+    """
+    dihedrals i-j-k-l of (M, 4) indices over all frames, same definition
+    and sign as get_dihedral
+        input:
+            standard: IUPAC torsion angles in (-180, 180] instead, unlike
+                get_dihedral they keep the cis/trans information of
+                planar structures
+        output:
+            (nframes, M) array, in degree unless arc
+    """
+    positions = get_trajectory_positions(positions)
+    i, j, k, l = _batch_indices(indices, 4)
+    if standard:
+        axis = _batch_normed(positions[:, k] - positions[:, j])
+        v0 = positions[:, i] - positions[:, j]
+        v2 = positions[:, l] - positions[:, k]
+        v0 = v0 - np.sum(v0 * axis, axis=-1, keepdims=True) * axis
+        v2 = v2 - np.sum(v2 * axis, axis=-1, keepdims=True) * axis
+        factor = 1 if arc else 180.0/math.pi
+        return np.arctan2(np.sum(np.cross(axis, v0) * v2, axis=-1),
+                          np.sum(v0 * v2, axis=-1)) * factor
+    v1 = _batch_normed(positions[:, i] - positions[:, j])
+    v2 = _batch_normed(positions[:, l] - positions[:, k])
+    vl = _batch_normed(positions[:, k] - positions[:, j])
+    return _batch_acos(np.sum(v1 * v2, axis=-1), arc) * \
+        np.sign(np.sum(v2 * np.cross(v1, vl), axis=-1))
+
+
+ZMATRIX_LINEAR_ANGLE = 5.0
+
+
+def _nearest_earlier_atoms(positions, cutoff):
+    """nearest atom with a lower index within cutoff, -1 if there is none"""
+    nearest = np.full(len(positions), -1)
+    first, second, dists = get_neighbor_list(positions, cutoff, bothways=True)
+    earlier = second < first
+    first, second, dists = first[earlier], second[earlier], dists[earlier]
+    order = np.lexsort((dists, first))
+    first, second = first[order], second[order]
+    unique = np.ones(len(first), dtype=bool)
+    unique[1:] = first[1:] != first[:-1]
+    nearest[first[unique]] = second[unique]
+    return nearest
+
+
+# atoms first queried by _nearest_candidate, multiplied until one fits
+NEAREST_CANDIDATES = 16
+
+
+def _nearest_tree(positions):
+    """cKDTree of positions for _nearest_candidate, None without scipy"""
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        return None
+    return cKDTree(positions)
+
+
+def _candidate_distances(positions, atoms, ai, center, excludes, line):
+    """distances of atoms to center, inf for the atoms not allowed"""
+    dists = norm(positions[atoms] - positions[center], axis=1)
+    dists[(atoms >= ai) | np.isin(atoms, excludes)] = np.inf
+    if line is not None:
+        v0 = _batch_normed(positions[line[1]] - positions[line[0]])
+        v1 = _batch_normed(positions[atoms] - positions[line[1]])
+        dists[abs(np.dot(v1, v0)) > cos(ZMATRIX_LINEAR_ANGLE)] = np.inf
+    return dists
+
+
+def _nearest_candidate(positions, ai, center, excludes, line=None,
+                       tree=None):
+    """
+    nearest atom before ai to center which is not in excludes and, if
+    line=(a, b) is given, not collinear with a-b (unless all are)
+
+    With tree (see _nearest_tree) the k nearest atoms of center are
+    searched with a growing k, O(m log N) if the result is among the m
+    nearest atoms. Otherwise all earlier atoms are scanned, O(ai).
+    """
+    if tree is not None:
+        k = NEAREST_CANDIDATES
+        while k < len(positions):
+            tree_dists, atoms = tree.query(positions[center], k)
+            dists = _candidate_distances(
+                positions, atoms, ai, center, excludes, line)
+            best = np.lexsort((atoms, dists))[0]
+            # an atom beyond the k nearest may only tie with the k-th one
+            if dists[best] < tree_dists[-1]:
+                return int(atoms[best])
+            k *= 4
+    atoms = np.arange(ai)
+    dists = _candidate_distances(positions, atoms, ai, center, excludes, line)
+    if not np.isfinite(dists).any():
+        dists = _candidate_distances(
+            positions, atoms, ai, center, excludes, None)
+    return int(np.argmin(dists))
+
+
+def _cartesian_to_zmatrix_nearest(positions, shown_length, same_length,
+                                  initial_num, indices, cutoff,
+                                  standard_dihedral):
+    natoms = len(positions)
+    # index the zmatrix_dict once
+    shown_parent = {}
+    for a0, a1 in sorted(shown_length):
+        shown_parent.setdefault(indices[a1], indices[a0])
+    same_length_group = {}
+    for group_index, group in enumerate(same_length):
+        for pair in group:
+            same_length_group.setdefault(tuple(pair), group_index)
+    same_bond_variables = {}
+
+    # choose the references: a0 is the nearest earlier atom, a1 and a2
+    # follow the chain of references
+    nearest = _nearest_earlier_atoms(positions, cutoff)
+    # for the atoms without references within cutoff
+    tree = _nearest_tree(positions) if natoms > BRUTE_FORCE_NATOMS else None
+    refs = np.full((natoms, 3), -1)
+    anchor = np.full(natoms, -1)
+    for ai in range(1, natoms):
+        a0 = shown_parent.get(ai, nearest[ai])
+        if a0 == -1:
+            a0 = _nearest_candidate(positions, ai, ai, [], tree=tree)
+        refs[ai, 0] = a0
+        if 0 <= a0 < natoms and anchor[a0] == -1:
+            anchor[a0] = ai
+        anchor[ai] = a0
+        if ai < 2:
+            continue
+        a1 = anchor[a0] if 0 <= a0 < natoms else -1
+        if not 0 <= a1 < ai or a1 == a0:
+            a1 = _nearest_candidate(positions, ai, a0, [a0], tree=tree)
+        refs[ai, 1] = a1
+        if ai < 3:
+            continue
+        a2 = anchor[a1]
+        if not 0 <= a2 < ai or a2 in (a0, a1):
+            a2 = _nearest_candidate(positions, ai, a1, [a0, a1], (a0, a1),
+                                    tree)
+        refs[ai, 2] = a2
+    # dihedral references collinear with a0-a1 are replaced
+    rows = np.flatnonzero(refs[:, 2] != -1)
+    angles = get_batch_angles(positions, np.stack(
+        (refs[rows, 2], refs[rows, 1], refs[rows, 0]), axis=1))[0]
+    linear = rows[abs(angles - 90) > 90 - ZMATRIX_LINEAR_ANGLE]
+    for ai in linear:
+        a0, a1 = refs[ai, :2]
+        refs[ai, 2] = _nearest_candidate(
+            positions, ai, a1, [a0, a1], (a0, a1), tree)
+
+    # all internal coordinates in batches
+    atoms = np.arange(natoms)
+    lengths = np.zeros(natoms)
+    angles = np.zeros(natoms)
+    dihedrals = np.zeros(natoms)
+    rows = atoms[1:]
+    lengths[rows] = get_batch_distances(
+        positions, np.stack((rows, refs[rows, 0]), axis=1))[0]
+    rows = atoms[2:]
+    angles[rows] = get_batch_angles(
+        positions, np.stack((rows, refs[rows, 0], refs[rows, 1]), axis=1))[0]
+    rows = atoms[3:]
+    dihedrals[rows] = get_batch_dihedrals(
+        positions, np.stack((rows, refs[rows, 0], refs[rows, 1],
+                             refs[rows, 2]), axis=1),
+        standard=standard_dihedral)[0]
+
+    zmatrix = [[[-1, -1], [-1, -1], [-1, -1]] for _ in range(natoms)]
+    variables = {}
+    for ai in range(1, natoms):
+        a0, a1, a2 = [int(x) for x in refs[ai]]
+        length = float(lengths[ai])
+        if ai in shown_parent:
+            alpha = 'R_'+str(a0+initial_num)+'_'+str(ai+initial_num)
+            group_index = same_length_group.get((a0, ai), None)
+            if group_index is not None and \
+                    group_index in same_bond_variables:
+                alpha = same_bond_variables[group_index]
+            else:
+                if group_index is not None:
+                    same_bond_variables[group_index] = alpha
+                variables[alpha] = [(a0, ai), length]
+            length = alpha
+        zmatrix[ai][0] = [a0 + initial_num, length]
+        if ai >= 2:
+            zmatrix[ai][1] = [a1 + initial_num, float(angles[ai])]
+        if ai >= 3:
+            zmatrix[ai][2] = [a2 + initial_num, float(dihedrals[ai])]
+    logger.debug(f"{zmatrix}, {variables}, {indices}")
+    return zmatrix, variables, indices
+
+
 def cartesian_to_zmatrix(positions, zmatrix_dict=None,
-                         initial_num=0, indices=None):
+                         initial_num=0, indices=None, reference='first',
+                         cutoff=3.0, standard_dihedral=False):
+    """
+    Cartesian coordinates to zmatrix
+        input:
+            reference: 'first' uses the first atoms as references,
+                'nearest' the nearest earlier atoms (found within cutoff)
+                and computes all internal coordinates in batches, it is
+                linear in the number of atoms if every atom has an earlier
+                one within cutoff. The others are found by a growing
+                nearest neighbor search with scipy, without scipy by a
+                scan of all earlier atoms: O(N^2) in the worst case
+                (sparse or gas phase inputs, a too small cutoff).
+            standard_dihedral: IUPAC torsion angles instead of the
+                get_dihedral definition, which is ambiguous for planar
+                structures, use it for an exact zmatrix_to_cartesian
+        output:
+            zmatrix, variables, indices
+    """
     def get_zmat_data(zmatrix_dict, keywords):
         return zmatrix_dict[keywords] if zmatrix_dict is not None \
             and keywords in zmatrix_dict else []
+    assert reference in ['first', 'nearest'], \
+        "reference should be 'first' or 'nearest'"
+    if reference == 'nearest':
+        positions = np.array(positions, dtype=float).reshape((-1, 3))
+        if indices is None:
+            indices = np.arange(len(positions))
+        return _cartesian_to_zmatrix_nearest(
+            positions, get_zmat_data(zmatrix_dict, 'shown_length'),
+            get_zmat_data(zmatrix_dict, 'same_length'),
+            initial_num, indices, cutoff, standard_dihedral)
     shown_length = get_zmat_data(zmatrix_dict, 'shown_length')
     shown_angle = get_zmat_data(zmatrix_dict, 'shown_angle')
     shown_dihedral = get_zmat_data(zmatrix_dict, 'shown_dihedral')
@@ -167,7 +459,11 @@ def cartesian_to_zmatrix(positions, zmatrix_dict=None,
                     break
             if a2 == -1:
                 raise ValueError('a2 is still -1')
-            dihedral = get_dihedral(positions, ai, a0, a1, a2)
+            if standard_dihedral:
+                dihedral = float(get_batch_dihedrals(
+                    positions, [ai, a0, a1, a2], standard=True)[0, 0])
+            else:
+                dihedral = get_dihedral(positions, ai, a0, a1, a2)
             logger.debug(f'dihedral:, {dihedral}')
             zmatrix[ai][2] = [a2, dihedral]
     if initial_num != 0:
@@ -179,6 +475,113 @@ def cartesian_to_zmatrix(positions, zmatrix_dict=None,
     return zmatrix, variables, indices
 
 
+def _zmatrix_value(value, variables):
+    if isinstance(value, str):
+        value = variables[value]
+        if isinstance(value, (list, tuple)):
+            value = value[-1]
+    return value
+
+
+def zmatrix_to_cartesian(zmatrix, variables=None, initial_num=0,
+                         standard_dihedral=False):
+    """
+    Rebuild Cartesian coordinates from a zmatrix with the Natural
+    Extension Reference Frame (NeRF) method, the inverse of
+    cartesian_to_zmatrix. The first atom is put at the origin, the second
+    along x and the third in the xy plane.
+        input:
+            zmatrix, variables: as given by cartesian_to_zmatrix,
+                variables may also map names to plain values. A list of
+                variables dicts rebuilds all conformers together.
+            initial_num: same as in cartesian_to_zmatrix
+            standard_dihedral: dihedrals are IUPAC torsion angles instead
+                of the get_dihedral definition
+        output:
+            (natoms, 3) array, or (nconformers, natoms, 3) for a batch
+    """
+    batch = isinstance(variables, (list, tuple))
+    variables_list = variables if batch else [variables or {}]
+    natoms = len(zmatrix)
+    refs = np.full((natoms, 3), -1)
+    values = np.zeros((len(variables_list), natoms, 3))
+    for ai, row in enumerate(zmatrix):
+        for col, (ref, value) in enumerate(row):
+            if ref == -1:
+                continue
+            refs[ai, col] = ref - initial_num
+            if isinstance(value, str):
+                values[:, ai, col] = [_zmatrix_value(value, x)
+                                      for x in variables_list]
+            else:
+                values[:, ai, col] = value
+    positions = zmatrix_values_to_cartesian(refs, values, standard_dihedral)
+    return positions if batch else positions[0]
+
+
+def zmatrix_values_to_cartesian(refs, values, standard_dihedral=False):
+    """
+    NeRF reconstruction of many conformers sharing the same references
+        input:
+            refs: (natoms, 3) reference atoms a0, a1, a2 of every atom
+            values: (nconformers, natoms, 3) length, angle and dihedral
+                (in degree) of every atom
+        output:
+            (nconformers, natoms, 3) array
+    """
+    refs = np.asarray(refs, dtype=int)
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 2:
+        values = values[np.newaxis]
+    nconf, natoms = values.shape[:2]
+    positions = np.zeros((nconf, natoms, 3))
+    lengths = values[:, :, 0]
+    theta = np.radians(values[:, :, 1])
+    phi = np.radians(values[:, :, 2])
+    for ai in range(1, natoms):
+        a0, a1, a2 = refs[ai]
+        if ai == 1 or a1 == -1:
+            positions[:, ai] = positions[:, a0] + \
+                lengths[:, ai, np.newaxis] * np.array([1., 0., 0.])
+            continue
+        e1 = _batch_normed(positions[:, a1] - positions[:, a0])
+        if a2 == -1:
+            w = np.zeros_like(e1)
+            w[:, 1] = 1
+        else:
+            w = _batch_normed(positions[:, a2] - positions[:, a1])
+        c = np.sum(w * e1, axis=-1)
+        perp = w - c[:, np.newaxis] * e1
+        s = norm(perp, axis=-1)
+        # a2 collinear with a0-a1, take any perpendicular direction
+        degenerate = s < EXTREME_SMALL
+        if degenerate.any():
+            other = np.where(abs(e1[:, :1]) < 0.9, [[1., 0., 0.]],
+                             [[0., 1., 0.]])
+            perp[degenerate] = np.cross(e1, other)[degenerate]
+            s = norm(perp, axis=-1)
+            c[degenerate] = 0
+        e2 = perp / s[:, np.newaxis]
+        e3 = np.cross(e1, e2)
+        cos_theta, sin_theta = np.cos(theta[:, ai]), np.sin(theta[:, ai])
+        if a2 == -1:
+            x, y = sin_theta, np.zeros(nconf)
+        elif standard_dihedral:
+            x, y = sin_theta * np.cos(phi[:, ai]), \
+                -sin_theta * np.sin(phi[:, ai])
+        else:
+            # get_dihedral is the signed angle between a0->ai and a1->a2
+            x = np.where(degenerate, sin_theta,
+                         (np.cos(phi[:, ai]) - c * cos_theta) / s)
+            x = np.clip(x, -abs(sin_theta), abs(sin_theta))
+            y = np.sign(phi[:, ai]) * np.sqrt(
+                np.maximum(sin_theta**2 - x**2, 0))
+        v1 = cos_theta[:, np.newaxis] * e1 + x[:, np.newaxis] * e2 + \
+            y[:, np.newaxis] * e3
+        positions[:, ai] = positions[:, a0] + lengths[:, ai, np.newaxis] * v1
+    return positions
+
+
 def cartesian_to_spherical(pos_o, pos_s):
     pos_o = np.array(pos_o)
     pos_s = np.array(pos_s)
@@ -216,15 +619,109 @@ def spherical_to_cartesian(pos_o, length, space_angle, space_angle0=(0, 0)):
 
 
 def rotate_site_angle(site_angle, theta, phi):
-    for site_angle_i in site_angle:
-        theta_i, phi_i = site_angle_i
-        site_angle_i = [theta_i+theta, phi_i+phi]
-    return site_angle
+    """
+    add (theta, phi) to every (theta_i, phi_i) of site_angle
+        output:
+            list of [theta_i + theta, phi_i + phi], a list as before
+    """
+    return (np.asarray(site_angle, dtype=float).reshape((-1, 2)) +
+            [theta, phi]).tolist()
+
+
+def kabsch_batch(positions, reference, weights=None, allow_reflection=False):
+    """
+    Optimal (least square) rotations and translations of many frames onto
+    a reference with the Kabsch algorithm, using all atoms
+        input:
+            positions: (nframes, natoms, 3) array or trajectory like object
+            reference: (natoms, 3) or (nframes, natoms, 3) array
+            weights: optional (natoms,) weights, e.g. masses
+            allow_reflection: allow improper rotations (det = -1)
+        output:
+            R, t: (nframes, 3, 3) and (nframes, 3) arrays,
+            positions[f].dot(R[f]) + t[f] is aligned to the reference
+    """
+    positions = get_trajectory_positions(positions)
+    reference = np.broadcast_to(
+        np.asarray(reference, dtype=float), positions.shape)
+    natoms = positions.shape[1]
+    weights = np.ones(natoms) if weights is None else \
+        np.asarray(weights, dtype=float)
+    weights = weights / weights.sum()
+    center = np.einsum('n,fni->fi', weights, positions)
+    ref_center = np.einsum('n,fni->fi', weights, reference)
+    H = np.einsum('fni,n,fnj->fij', positions - center[:, np.newaxis],
+                  weights, reference - ref_center[:, np.newaxis])
+    U, _, Vt = np.linalg.svd(H)
+    if not allow_reflection:
+        U[:, :, -1] *= np.sign(np.linalg.det(np.matmul(U, Vt)))[:, np.newaxis]
+    R = np.matmul(U, Vt)
+    t = ref_center - np.einsum('fi,fij->fj', center, R)
+    return R, t
+
+
+def kabsch(positions, reference, weights=None, allow_reflection=False):
+    """
+    optimal rotation R and translation t so that positions.dot(R) + t
+    fits the reference, see kabsch_batch
+    """
+    R, t = kabsch_batch(get_positions(positions), get_positions(reference),
+                        weights, allow_reflection)
+    return R[0], t[0]
+
+
+def align_positions(positions, reference, weights=None,
+                    allow_reflection=False):
+    """
+    positions of all frames optimally aligned onto the reference
+        output:
+            (nframes, natoms, 3) array
+    """
+    positions = get_trajectory_positions(positions)
+    R, t = kabsch_batch(positions, reference, weights, allow_reflection)
+    return np.matmul(positions, R) + t[:, np.newaxis]
+
+
+def get_rmsd(positions, reference, align=True, weights=None):
+    """
+    root mean square deviation to the reference, after optimal alignment
+    if align
+        output:
+            float for a single frame, (nframes,) array for a trajectory
+    """
+    single = np.ndim(getattr(positions, 'positions', positions)) == 2
+    positions = get_trajectory_positions(positions)
+    if align:
+        positions = align_positions(positions, reference, weights)
+    natoms = positions.shape[1]
+    weights = np.ones(natoms) if weights is None else \
+        np.asarray(weights, dtype=float)
+    square = np.sum(np.square(positions - np.asarray(reference)), axis=-1)
+    rmsd = np.sqrt(np.dot(square, weights) / weights.sum())
+    return float(rmsd[0]) if single else rmsd
 
 
 def input_standard_pos_transform(inp_pos, std_pos, t_vals,
-                                 std_to_inp=True, is_coord=False):
+                                 std_to_inp=True, is_coord=False,
+                                 method='combination'):
+    """
+    transform t_vals between the standard and the input frame
+        input:
+            method: 'combination' solves the transformation from the first
+                well conditioned atom triple, 'kabsch' fits the optimal
+                rotation to all atoms
+    """
+    assert method in ['combination', 'kabsch'], \
+        "method should be 'combination' or 'kabsch'"
     t_vals = np.array(t_vals).copy()
+    if method == 'kabsch':
+        R_mat, trans = kabsch(std_pos, inp_pos)
+        if not is_coord:
+            trans = np.zeros(3)
+        if std_to_inp:
+            return np.dot(t_vals, R_mat) + trans
+        else:
+            return np.dot(t_vals - trans, R_mat.T)
     std_O = np.array(std_pos)[-1].copy()
     inp_O = np.array(inp_pos)[-1].copy()
     std_pos = np.array(std_pos).copy() - std_O
@@ -291,23 +788,331 @@ def get_X_Y_dist_matrix(X, Y=None):
         + np.sum(np.square(Y), axis=1).reshape((1, -1)) - 2 * np.dot(X, Y.T)
 
 
-def get_distance_matrix(positions):
-    cell = None
-    if hasattr(positions, 'cell'):
-        cell = positions.cell
+def get_cell_and_pbc(atoms):
+    """
+    cell and pbc of a Atoms like object, (None, None) if it is not periodic.
+    Objects with a cell but without pbc are considered fully periodic.
+    """
+    if getattr(atoms, 'cell', None) is None:
+        return None, None
+    cell = np.array(atoms.cell, dtype=float).reshape((3, 3))
+    pbc = np.ones(3, dtype=bool) & np.array(getattr(atoms, 'pbc', True))
+    pbc &= norm(cell, axis=1) > EXTREME_SMALL
+    if not pbc.any():
+        return None, None
+    return cell, pbc
+
+
+def complete_cell(cell):
+    """
+    replace the missing (zero) cell vectors by unit vectors orthogonal to
+    the others so that the cell can be inverted
+    """
+    cell = np.array(cell, dtype=float).reshape((3, 3))
+    missing = np.flatnonzero(norm(cell, axis=1) < EXTREME_SMALL)
+    if len(missing) == 3:
+        return np.identity(3)
+    elif len(missing) == 2:
+        a = normed(cell[3 - missing.sum()])
+        b = normed(np.cross(a, [1, 0, 0] if abs(a[0]) < 0.9 else [0, 1, 0]))
+        cell[missing[0]], cell[missing[1]] = b, np.cross(a, b)
+    elif len(missing) == 1:
+        i = missing[0]
+        cell[i] = normed(np.cross(cell[(i+1) % 3], cell[(i+2) % 3]))
+    return cell
+
+
+def get_cell_heights(cell):
+    """distances between the opposite faces of the cell"""
+    cell = complete_cell(cell)
+    volume = abs(np.linalg.det(cell))
+    return volume / norm(np.cross(cell[[1, 2, 0]], cell[[2, 0, 1]]), axis=1)
+
+
+def find_mic(vectors, cell, pbc=True):
+    """
+    Minimum image convention for displacement vectors in any (triclinic)
+    cell. Vectors are wrapped once in fractional coordinates, only for
+    skewed cells the vectors that may still have a shorter image are
+    checked against a bounded set of neighbor images.
+        input:
+            vectors: (..., 3) array
+            cell: 3x3 array
+            pbc: bool or 3 bools
+        output:
+            mic_vectors, lengths, offsets: mic_vectors = vectors +
+            offsets.dot(cell), offsets are the integer image shifts
+    """
+    vectors = np.array(vectors, dtype=float)
+    cell = np.array(cell, dtype=float).reshape((3, 3))
+    pbc = np.ones(3, dtype=bool) & np.array(pbc)
+    pbc &= norm(cell, axis=1) > EXTREME_SMALL
+    offsets = np.zeros(vectors.shape, dtype=int)
+    if not pbc.any():
+        return vectors, norm(vectors, axis=-1), offsets
+    frac = np.dot(vectors, np.linalg.inv(complete_cell(cell)))
+    offsets[..., pbc] = -np.round(frac[..., pbc]).astype(int)
+    vectors += np.dot(offsets, cell)
+    lengths = norm(vectors, axis=-1)
+
+    metric = np.dot(cell[pbc], cell[pbc].T)
+    if np.allclose(metric, np.diag(np.diag(metric))) or lengths.size == 0:
+        # wrapping is exact for orthogonal cells
+        return vectors, lengths, offsets
+    # an image with another shift along a periodic axis i is at least
+    # heights[i]/2 long, shorter vectors are already minimal
+    heights = get_cell_heights(cell)
+    flat_vectors = vectors.reshape((-1, 3))
+    flat_lengths = lengths.reshape(-1)
+    flat_offsets = offsets.reshape((-1, 3))
+    todo = np.flatnonzero(flat_lengths > heights[pbc].min() / 2)
+    if not len(todo):
+        return vectors, lengths, offsets
+    vec, length = flat_vectors[todo], flat_lengths[todo]
+    shift_sum = np.zeros((len(todo), 3), dtype=int)
+    # |shift_i| <= 1/2 + |v|/heights_i for any shorter image
+    bound = np.where(pbc, np.floor(0.5 + length.max() / heights), 0)
+    for shift in itertools.product(*[range(-int(n), int(n)+1) for n in bound]):
+        if not any(shift):
+            continue
+        candidate = vec + np.dot(shift, cell)
+        candidate_length = norm(candidate, axis=1)
+        better = candidate_length < length - EXTREME_SMALL
+        if better.any():
+            length[better] = candidate_length[better]
+            shift_sum[better] = shift
+    vec += np.dot(shift_sum, cell)
+    flat_vectors[todo] = vec
+    flat_lengths[todo] = length
+    flat_offsets[todo] += shift_sum
+    return vectors, lengths, offsets
+
+
+MIC_CHUNK_SIZE = 2 ** 20
+
+
+def get_distance_matrix(positions, return_offsets=False):
+    """
+    distance matrix of all atoms, minimum image distances are used for
+    periodic objects (with cell)
+        output:
+            dist_matrix, (offsets if return_offsets, see find_mic)
+    """
+    cell, pbc = get_cell_and_pbc(positions)
     positions = get_positions(positions)
-    dist_matrix = get_X_Y_dist_matrix(positions)
-    if cell is not None:
-        for index in itertools.product([-1, 0, 1], [-1, 0, 1], [-1, 0, 1]):
-            mpositions = positions + np.sum(cell * index, axis=0)
-            dist_matrix = np.min(
-                (dist_matrix, get_X_Y_dist_matrix(mpositions, positions)), axis=0)
-            # print(dist_matrix)
-    dist_matrix = np.sqrt(abs(dist_matrix))
-    np.fill_diagonal(dist_matrix, 0)
+    natoms = len(positions)
+    if cell is None:
+        dist_matrix = np.sqrt(abs(get_X_Y_dist_matrix(positions)))
+        np.fill_diagonal(dist_matrix, 0)
+        if return_offsets:
+            return dist_matrix, np.zeros((natoms, natoms, 3), dtype=int)
+        return dist_matrix
+    dist_matrix = np.zeros((natoms, natoms))
+    if return_offsets:
+        offsets = np.zeros((natoms, natoms, 3), dtype=int)
+    # process rows in chunks to avoid (natoms, natoms, 3) temporaries
+    nrows = max(1, MIC_CHUNK_SIZE // max(natoms, 1))
+    for start in range(0, natoms, nrows):
+        vectors = positions[np.newaxis, :, :] - \
+            positions[start:start+nrows, np.newaxis, :]
+        _, lengths, chunk_offsets = find_mic(vectors, cell, pbc)
+        dist_matrix[start:start+nrows] = lengths
+        if return_offsets:
+            offsets[start:start+nrows] = chunk_offsets
+    if return_offsets:
+        return dist_matrix, offsets
     return dist_matrix
 
 
+NEIGHBOR_METHODS = ['auto', 'cell', 'tree', 'brute']
+BRUTE_FORCE_NATOMS = 256
+MAX_BINS_PER_AXIS = 2 ** 20
+# 13 "forward" bin shifts plus the bin itself, every pair of bins is
+# visited exactly once
+HALF_STENCIL = [shift for shift in itertools.product([-1, 0, 1], repeat=3)
+                if shift > (0, 0, 0)]
+
+
+def _brute_force_pairs(positions, cutoff):
+    dist_matrix = np.sqrt(abs(get_X_Y_dist_matrix(positions)))
+    return np.nonzero(np.triu(dist_matrix <= cutoff, k=1))
+
+
+def _tree_pairs(positions, cutoff):
+    from scipy.spatial import cKDTree
+    pairs = cKDTree(positions).query_pairs(cutoff, output_type='ndarray')
+    return pairs[:, 0], pairs[:, 1]
+
+
+def _cell_list_pairs(positions, cutoff):
+    """
+    binned cell list, bins are at least `cutoff` wide so that only the
+    neighboring bins have to be searched
+    """
+    origin = positions.min(axis=0)
+    extent = positions.max(axis=0) - origin
+    width = np.maximum(cutoff, extent / MAX_BINS_PER_AXIS)
+    nbins = np.floor(extent / width).astype(np.int64) + 1
+    bins = np.minimum(np.floor((positions - origin) / width).astype(np.int64),
+                      nbins - 1)
+    bin_ids = np.ravel_multi_index(bins.T, nbins)
+    order = np.argsort(bin_ids, kind='stable')
+    occupied, starts, counts = np.unique(
+        bin_ids[order], return_index=True, return_counts=True)
+
+    first_list, second_list = [], []
+    for shift in [(0, 0, 0)] + HALF_STENCIL:
+        shifted = bins + shift
+        atoms = np.flatnonzero(
+            np.all((shifted >= 0) & (shifted < nbins), axis=1))
+        shifted_ids = np.ravel_multi_index(shifted[atoms].T, nbins)
+        loc = np.minimum(np.searchsorted(occupied, shifted_ids),
+                         len(occupied) - 1)
+        found = occupied[loc] == shifted_ids
+        atoms, loc = atoms[found], loc[found]
+        # expand every atom against all atoms of its shifted bin
+        cnt = counts[loc]
+        first = np.repeat(atoms, cnt)
+        local = np.arange(cnt.sum()) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        second = order[np.repeat(starts[loc], cnt) + local]
+        if shift == (0, 0, 0):
+            keep = first < second
+            first, second = first[keep], second[keep]
+        keep = np.sum(np.square(positions[first] - positions[second]),
+                      axis=1) <= cutoff * cutoff
+        first_list.append(first[keep])
+        second_list.append(second[keep])
+    first = np.concatenate(first_list)
+    second = np.concatenate(second_list)
+    return np.minimum(first, second), np.maximum(first, second)
+
+
+def _find_pairs(positions, cutoff, method):
+    natoms = len(positions)
+    if method == 'auto':
+        if natoms <= BRUTE_FORCE_NATOMS:
+            method = 'brute'
+        else:
+            try:
+                import scipy.spatial
+                method = 'tree'
+            except ImportError:
+                method = 'cell'
+    if natoms < 2:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    elif method == 'brute':
+        return _brute_force_pairs(positions, cutoff)
+    elif method == 'tree':
+        return _tree_pairs(positions, cutoff)
+    return _cell_list_pairs(positions, cutoff)
+
+
+def _periodic_pairs(positions, cutoff, cell, pbc, method):
+    """
+    minimum image pairs within cutoff, found by a non-periodic search over
+    the wrapped atoms plus their images close to the cell faces
+        output:
+            first, second, offsets: first < second, see find_mic for offsets
+    """
+    natoms = len(positions)
+    frac = np.dot(positions, np.linalg.inv(complete_cell(cell)))
+    wrap = np.where(pbc, -np.floor(frac), 0).astype(int)
+    frac += wrap
+    margin = cutoff / get_cell_heights(cell)
+    nimages = np.where(pbc, np.ceil(margin), 0).astype(int)
+    images, shifts = [], []
+    for shift in itertools.product(*[range(-n, n+1) for n in nimages]):
+        image = frac + shift
+        inside = np.flatnonzero(np.all(
+            ~pbc | ((image > -margin) & (image < 1 + margin)), axis=1))
+        if not any(shift):
+            inside = np.arange(natoms)
+        images.append(inside)
+        shifts.append(wrap[inside] + shift)
+    # the unshifted image comes first, so index < natoms are the originals
+    zero = (len(images) - 1) // 2
+    images.insert(0, images.pop(zero))
+    shifts.insert(0, shifts.pop(zero))
+    images = np.concatenate(images)
+    shifts = np.concatenate(shifts)
+    ext_first, ext_second = _find_pairs(
+        positions[images] + np.dot(shifts, cell), cutoff, method)
+    keep = (ext_first < natoms) | (ext_second < natoms)
+    ext_first, ext_second = ext_first[keep], ext_second[keep]
+    first, second = images[ext_first], images[ext_second]
+    offsets = shifts[ext_second] - shifts[ext_first]
+    swap = first > second
+    first[swap], second[swap] = second[swap], first[swap]
+    offsets[swap] *= -1
+    keep = first != second
+    return first[keep], second[keep], offsets[keep]
+
+
+def get_neighbor_list(positions, cutoff, method='auto', bothways=False,
+                      return_offsets=False):
+    """
+    Find all atom pairs within cutoff without building the N*N distance
+    matrix, memory scales with the number of pairs found.
+    For periodic objects (with cell) every pair appears once with its
+    minimum image distance, same as get_distance_matrix.
+        input:
+            positions: Atoms like object or (natoms, 3) array
+            cutoff: float, in the same unit of positions
+            method: 'auto', 'cell' (binned cell list), 'tree' (scipy
+                cKDTree) or 'brute' (dense, small systems only)
+            bothways: return both (i, j) and (j, i) if True, otherwise
+                only i < j
+            return_offsets: also return the image offsets, the distance
+                vector of a pair is
+                positions[j] - positions[i] + offsets.dot(cell)
+        output:
+            first, second, distances(, offsets): sorted by (first, second)
+    """
+    assert method in NEIGHBOR_METHODS, \
+        f'method should be one of {NEIGHBOR_METHODS}'
+    cell, pbc = get_cell_and_pbc(positions)
+    positions = get_positions(positions).astype(float)
+    if cell is None:
+        first, second = _find_pairs(positions, cutoff, method)
+        offsets = np.zeros((len(first), 3), dtype=int)
+        cell = np.zeros((3, 3))
+    else:
+        first, second, offsets = _periodic_pairs(
+            positions, cutoff, cell, pbc, method)
+    if bothways:
+        first, second = np.concatenate((first, second)), \
+            np.concatenate((second, first))
+        offsets = np.concatenate((offsets, -offsets))
+    first, second = first.astype(int), second.astype(int)
+    distances = norm(positions[second] - positions[first]
+                     + np.dot(offsets, cell), axis=1)
+    # sort by (first, second) and keep the shortest image of every pair
+    order = np.lexsort((distances, second, first))
+    first, second = first[order], second[order]
+    distances, offsets = distances[order], offsets[order]
+    unique = np.ones(len(first), dtype=bool)
+    unique[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+    if return_offsets:
+        return first[unique], second[unique], distances[unique], \
+            offsets[unique]
+    return first[unique], second[unique], distances[unique]
+
+
+def get_sparse_distance_matrix(positions, cutoff, method='auto',
+                               sparse_format='coo'):
+    """
+    scipy.sparse distance matrix with the pairs within cutoff only,
+    see get_neighbor_list for the parameters
+    """
+    import scipy.sparse
+    natoms = len(get_positions(positions))
+    first, second, distances = get_neighbor_list(
+        positions, cutoff, method=method, bothways=True)
+    dist_matrix = scipy.sparse.coo_matrix(
+        (distances, (first, second)), shape=(natoms, natoms))
+    return dist_matrix.asformat(sparse_format)
+
+
 def dist_change_matrix(positions, dpos):
     # dpos = dpos.copy()
     positions = positions.copy()
@@ -316,19 +1121,61 @@ def dist_change_matrix(positions, dpos):
     return dists1 - dists0
 
 
+_COVALENT_RADII = None
+
+
+def get_covalent_radii(numbers):
+    """
+    covalent radii of atomic numbers (or symbols), looked up in a table
+    indexed by atomic number which is built from chemdata only once
+    """
+    global _COVALENT_RADII
+    if _COVALENT_RADII is None:
+        radii = np.full(len(chemdata.chemical_symbols), np.nan)
+        for number in range(len(radii)):
+            try:
+                radii[number] = chemdata.get_element_covalent(number)
+            except (KeyError, TypeError, ValueError):
+                pass
+        _COVALENT_RADII = radii
+    numbers = np.asarray(numbers)
+    if not np.issubdtype(numbers.dtype, np.integer):
+        numbers = np.array([chemdata.get_element_number(x)
+                            for x in numbers.reshape(-1)], dtype=int)
+    radii = _COVALENT_RADII[numbers]
+    if np.isnan(radii).any():
+        raise KeyError('no covalent radius for atomic numbers {0}'.format(
+            np.unique(numbers[np.isnan(radii)]).tolist()))
+    return radii
+
+
 def get_contact_matrix(positions, numbers=None, bonding_distance_matrix=None,
-                       n=6, m=12):
+                       n=6, m=12, sparse=None, cutoff=1.5):
+    """
+    contact matrix using the switching function (1-r^n)/(1-r^m), where r
+    is the distance divided by the bonding distance (sum of the covalent
+    radii by default)
+        input:
+            sparse: None for a dense matrix, or a scipy.sparse format
+                ('coo', 'csr', ...). Only the pairs closer than cutoff
+                times the bonding distance are evaluated and stored, the
+                diagonal is kept (contact 1) as in the dense matrix.
+    Periodic objects (with cell) use minimum image distances in both the
+    dense and the sparse matrix.
+    """
+    if hasattr(positions, 'numbers'):
+        numbers = positions.numbers
+    if sparse:
+        return _get_sparse_contact_matrix(
+            positions, numbers, bonding_distance_matrix, n, m,
+            sparse, cutoff)
     if bonding_distance_matrix is None:
-        if hasattr(positions, 'numbers'):
-            numbers = positions.numbers
         assert numbers is not None
-        bonding_distance_matrix = np.array(
-            [chemdata.get_element_covalent(x) for x in numbers])
+        bonding_distance_matrix = get_covalent_radii(numbers)
         bonding_distance_matrix = bonding_distance_matrix.reshape(
             (1, -1)) + bonding_distance_matrix.reshape((-1, 1))
         # bonding_distance_matrix *= 0
-    # print('positions', positions)
-    positions = get_positions(positions)
+    # the cell is needed for minimum image distances
     distance_matrix = get_distance_matrix(positions)
     rx = distance_matrix / bonding_distance_matrix
     contact_matrix = (1 - np.power(rx, n)) / (1 - np.power(rx, m))
@@ -337,10 +1184,106 @@ def get_contact_matrix(positions, numbers=None, bonding_distance_matrix=None,
     return contact_matrix
 
 
-def freq_dist_change_matrix(XX, positions):
-    XX = XX.copy()
-    dists0 = get_distance_matrix(positions)
-    return np.array([get_distance_matrix(x) for x in XX+positions]) - dists0
+def _get_sparse_contact_matrix(positions, numbers, bonding_distance_matrix,
+                               n, m, sparse_format, cutoff):
+    import scipy.sparse
+    natoms = len(get_positions(positions))
+    if bonding_distance_matrix is None:
+        assert numbers is not None
+        radii = get_covalent_radii(numbers)
+        max_bonding_distance = 2 * radii.max() if natoms else 0
+    else:
+        bonding_distance_matrix = np.asarray(bonding_distance_matrix)
+        max_bonding_distance = bonding_distance_matrix.max() if natoms else 0
+    first, second, distances = get_neighbor_list(
+        positions, cutoff * max_bonding_distance, bothways=True)
+    if bonding_distance_matrix is None:
+        bonding_distances = radii[first] + radii[second]
+    else:
+        bonding_distances = bonding_distance_matrix[first, second]
+    keep = distances < cutoff * bonding_distances
+    rx = distances[keep] / bonding_distances[keep]
+    contact = (1 - np.power(rx, n)) / (1 - np.power(rx, m))
+    diagonal = np.arange(natoms)
+    contact_matrix = scipy.sparse.coo_matrix(
+        (np.concatenate((contact, np.ones(natoms))),
+         (np.concatenate((first[keep], diagonal)),
+          np.concatenate((second[keep], diagonal)))),
+        shape=(natoms, natoms))
+    return contact_matrix.asformat(sparse_format)
+
+
+FREQ_CHUNK_SIZE = 2 ** 23
+
+
+def _batch_distance_matrix(positions):
+    square = np.sum(np.square(positions), axis=-1)
+    dist_matrix = square[:, :, np.newaxis] + square[:, np.newaxis, :] \
+        - 2 * np.matmul(positions, positions.transpose((0, 2, 1)))
+    dist_matrix = np.sqrt(abs(dist_matrix))
+    dist_matrix[:, np.arange(positions.shape[1]),
+                np.arange(positions.shape[1])] = 0
+    return dist_matrix
+
+
+def iter_freq_dist_change(XX, positions, pairs=None, chunk_size=None):
+    """
+    Distance changes of normal modes, chunk by chunk, so that only
+    chunk_size modes are held in memory.
+        input:
+            XX: (nmodes, natoms, 3) displacements
+            positions: (natoms, 3) equilibrium positions
+            pairs: optional (M, 2) atom pairs, only their distances are used
+            chunk_size: modes per chunk, by default about FREQ_CHUNK_SIZE
+                distances per chunk
+        output:
+            generator of (start, changes), changes is a
+            (chunk, natoms, natoms) or (chunk, M) array for the modes
+            start:start+chunk
+    """
+    positions = get_positions(positions)
+    natoms = len(positions)
+    nmodes = len(XX)
+    if pairs is not None:
+        pairs = np.asarray(pairs, dtype=int).reshape((-1, 2))
+        dists0 = get_batch_distances(positions, pairs)
+        size = len(pairs)
+    else:
+        dists0 = get_distance_matrix(positions)[np.newaxis]
+        size = natoms * natoms
+    chunk_size = chunk_size or max(1, FREQ_CHUNK_SIZE // max(size, 1))
+    for start in range(0, nmodes, chunk_size):
+        frames = np.asarray(XX[start:start+chunk_size]).reshape(
+            (-1, natoms, 3)) + positions
+        if pairs is not None:
+            dists = get_batch_distances(frames, pairs)
+        else:
+            dists = _batch_distance_matrix(frames)
+        dists -= dists0
+        yield start, dists
+
+
+def freq_dist_change_matrix(XX, positions, pairs=None, out=None,
+                            chunk_size=None):
+    """
+    distance change matrix of every normal mode
+        input:
+            pairs: optional (M, 2) atom pairs, see iter_freq_dist_change
+            out: optional preallocated (nmodes, natoms, natoms) or
+                (nmodes, M) array or np.memmap to write into
+        output:
+            out
+    """
+    natoms = len(get_positions(positions))
+    shape = (len(XX), natoms, natoms) if pairs is None else \
+        (len(XX), len(np.asarray(pairs).reshape((-1, 2))))
+    if out is None:
+        out = np.empty(shape)
+    assert out.shape == shape, f'out should be {shape}'
+    for start, dists in iter_freq_dist_change(
+            XX, positions, pairs=pairs, chunk_size=chunk_size):
+        out[start:start+len(dists)] = dists
+    return out
 
 
 def get_rotation_matrix(k, theta, radians=False):
@@ -353,17 +1296,97 @@ def get_rotation_matrix(k, theta, radians=False):
     Reference:
     https://baike.baidu.com/item/%E7%BD%97%E5%BE%B7%E9%87%8C%E6%A0%BC%E6%97%8B%E8%BD%AC%E5%85%AC%E5%BC%8F/18878562?fr=aladdin
     """
-    k = normed(k)
-    if not radians:
-        theta = math.radians(theta)
-    kx = k[0]
-    ky = k[1]
-    kz = k[2]
-    # k_c = k[np.newaxis].T # which now is column vector
-    k_outer = np.outer(k, k)
-    R = np.identity(3)*math.cos(theta) + (1-math.cos(theta))*k_outer + \
-        math.sin(theta)*np.matrix([[0, -kz, ky], [kz, 0, -kx], [-ky, kx, 0]])
-    return np.array(R)
+    return get_rotation_matrices(k, theta, radians)[0]
+
+
+def get_rotation_matrices(axes, angles, radians=False):
+    """
+    Rodrigues' rotation matrices of many axis/angle pairs, same convention
+    as get_rotation_matrix (v' = R.dot(v))
+        input:
+            axes: (K, 3) or (3,) array, normalized here
+            angles: (K,) array or float, in degree unless radians
+        output:
+            (K, 3, 3) array
+    """
+    axes = np.asarray(axes, dtype=float).reshape((-1, 3))
+    angles = np.asarray(angles, dtype=float).reshape(-1)
+    axes, angles = np.broadcast_arrays(axes, angles[:, np.newaxis])
+    angles = angles[:, 0] if radians else np.radians(angles[:, 0])
+    k = _batch_normed(axes)
+    kx, ky, kz = k[:, 0], k[:, 1], k[:, 2]
+    zeros = np.zeros(len(k))
+    k_cross = np.stack((zeros, -kz, ky, kz, zeros, -kx, -ky, kx, zeros),
+                       axis=1).reshape((-1, 3, 3))
+    cos_theta = np.cos(angles)[:, np.newaxis, np.newaxis]
+    sin_theta = np.sin(angles)[:, np.newaxis, np.newaxis]
+    return np.identity(3) * cos_theta + (1 - cos_theta) * \
+        k[:, :, np.newaxis] * k[:, np.newaxis, :] + sin_theta * k_cross
+
+
+def quaternion_to_rotation_matrix(quaternions):
+    """
+    rotation matrices (v' = R.dot(v)) of (K, 4) quaternions (w, x, y, z),
+    normalized here
+        output:
+            (K, 3, 3) array
+    """
+    w, x, y, z = _batch_normed(np.asarray(
+        quaternions, dtype=float).reshape((-1, 4))).T
+    return np.stack((
+        1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w),
+        2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w),
+        2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y),
+    ), axis=1).reshape((-1, 3, 3))
+
+
+def random_quaternions(size, rng=None):
+    """
+    uniformly distributed random unit quaternions (w, x, y, z), K. Shoemake,
+    Uniform random rotations, Graphics Gems III, 1992
+        input:
+            rng: np.random.Generator, or a seed
+        output:
+            (size, 4) array
+    """
+    rng = np.random.default_rng(rng)
+    u1, u2, u3 = rng.random((3, size))
+    return np.stack((np.sqrt(1 - u1) * np.sin(2*np.pi*u2),
+                     np.sqrt(1 - u1) * np.cos(2*np.pi*u2),
+                     np.sqrt(u1) * np.sin(2*np.pi*u3),
+                     np.sqrt(u1) * np.cos(2*np.pi*u3)), axis=1)
+
+
+def random_rotation_matrices(size, rng=None):
+    """uniformly distributed random (size, 3, 3) rotation matrices"""
+    return quaternion_to_rotation_matrix(random_quaternions(size, rng))
+
+
+def rotate_positions(positions, rotations, center=None, out=None):
+    """
+    Apply rotation matrices (v' = R.dot(v)) to coordinates in one pass
+        input:
+            positions: (N, 3) or (K, N, 3) array
+            rotations: (3, 3) or (K, 3, 3) array
+            center: optional rotation center, (3,) or (K, 3)
+            out: optional (K, N, 3) output array, may be positions itself
+                to rotate in place
+        output:
+            out, or a new (K, N, 3) array
+    """
+    positions = np.asarray(positions, dtype=float)
+    rotations = np.asarray(rotations, dtype=float)
+    rotations_T = np.swapaxes(rotations, -1, -2)
+    if center is None:
+        return np.matmul(positions, rotations_T, out=out)
+    center = np.asarray(center, dtype=float).reshape((-1, 1, 3))
+    if out is None:
+        out = np.matmul(positions - center, rotations_T)
+    else:
+        np.subtract(positions, center, out=out)
+        np.matmul(out, rotations_T, out=out)
+    out += center
+    return out
 
 
 def cellpar_to_cell(cellpar, ab_normal=(0, 0, 1), a_direction=None):
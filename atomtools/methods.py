@@ -9,29 +9,40 @@ general methods used for GASE
 """
 
 import numpy as np
+from collections.abc import Sequence
 
 
-def __get_atoms_arrays(obj):
+def _readonly(array):
+    """read-only view of array, no copy"""
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
+
+
+def __get_atoms_arrays(obj, copy=True):
     """
     basic transform atoms to arrays
+    copy=False gives read-only views of the atoms arrays
     """
     if isinstance(obj, dict):
         return obj
     obj_type = f"{obj.__class__.__module__}.{obj.__class__.__name__}"
+    transform = (lambda x: x.copy()) if copy else _readonly
     if obj_type in ['ase.atoms.Atoms', 'gase.aseshell.AtomsShell']:
-        arrays = obj.arrays.copy()
+        arrays = {key: transform(val) for key, val in obj.arrays.items()}
         if obj_type == 'ase.atoms.Atoms':
             # set cell & pbc
-            arrays['cell'] = obj.cell.array.copy()
-            arrays['pbc'] = obj.pbc.copy()
+            arrays['cell'] = transform(obj.cell.array)
+            arrays['pbc'] = transform(obj.pbc)
             arrays['cell_disp'] = obj.get_celldisp()
             calc = obj.calc
             if calc is not None:
+                arrays['calc_arrays'] = dict()
                 if calc.name:
-                    arrays['calc_arrays'] = {'name': calc.name}
+                    arrays['calc_arrays']['name'] = calc.name
                 if calc.parameters:
                     arrays['calc_arrays'].update(calc.parameters)
-                if calc.result:
+                if calc.results:
                     arrays['calc_arrays'].update(calc.results)
     elif obj_type == 'pymatgen.core.structure.Structure':
         raise NotImplementedError("Pymatgen will be supported in the future")
@@ -40,21 +51,83 @@ def __get_atoms_arrays(obj):
     return arrays
 
 
-def get_atoms_arrays(obj):
+class PackedAtomsArrays(Sequence):
+    """
+    same-size frames packed into contiguous arrays
+        arrays: name -> (nframes, ...) array, e.g. positions
+            (nframes, natoms, 3)
+        extras: name -> list of per-frame values which can not be stacked
+    packed[k] is a lazy dict of views into the packed arrays for frame k,
+    packed.positions etc. are the packed arrays (see geo.get_batch_*)
+    """
+
+    def __init__(self, arrays, extras, nframes):
+        self.arrays = arrays
+        self.extras = extras
+        self.nframes = nframes
+
+    def __len__(self):
+        return self.nframes
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PackedAtomsArrays(
+                {key: val[index] for key, val in self.arrays.items()},
+                {key: val[index] for key, val in self.extras.items()},
+                len(range(self.nframes)[index]))
+        index = range(self.nframes)[index]
+        frame = {key: val[index] for key, val in self.arrays.items()}
+        frame.update({key: val[index] for key, val in self.extras.items()})
+        return frame
+
+    def __getattr__(self, name):
+        arrays = self.__dict__.get('arrays', {})
+        if name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+
+def pack_atoms_arrays(frames):
+    """
+    pack a list of arrays dicts into a PackedAtomsArrays, the values with
+    the same shape in every frame are stacked with one copy
+    """
+    frames = list(frames)
+    arrays, extras = dict(), dict()
+    if not frames:
+        return PackedAtomsArrays(arrays, extras, 0)
+    keys = [key for key in frames[0] if all(key in x for x in frames)]
+    for key in keys:
+        values = [x[key] for x in frames]
+        if all(isinstance(x, np.ndarray) for x in values) and \
+                len(set(x.shape for x in values)) == 1:
+            arrays[key] = np.stack(values)
+        else:
+            extras[key] = values
+    return PackedAtomsArrays(arrays, extras, len(frames))
+
+
+def get_atoms_arrays(obj, copy=True, packed=False):
     """
     Transform a Atoms like object to arrays(dict/list of dict)
         input:
             obj: dict/list/ase.Atoms/gase.AtomsShell (future: pymatgen.core.structure.Structure)
+            copy: False to get read-only views of the atoms arrays
+            packed: pack the frames of a list/NEB into a PackedAtomsArrays
         output:
-            arrays(dict/list of dict)
+            arrays(dict/list of dict/PackedAtomsArrays)
     """
     obj_type = f"{obj.__class__.__module__}.{obj.__class__.__name__}"
+    # packing copies once, the frames can be views
+    copy = copy and not packed
     if isinstance(obj, dict):
         arrays = obj
     elif isinstance(obj, (list, np.ndarray)):
-        arrays = [__get_atoms_arrays(x) for x in obj]
+        arrays = [__get_atoms_arrays(x, copy) for x in obj]
     elif obj_type == 'ase.neb.NEB':
-        arrays = [__get_atoms_arrays(x) for x in obj.images]
+        arrays = [__get_atoms_arrays(x, copy) for x in obj.images]
     else:
-        arrays = __get_atoms_arrays(obj)
+        arrays = __get_atoms_arrays(obj, copy)
+    if packed and isinstance(arrays, list):
+        arrays = pack_atoms_arrays(arrays)
     return arrays
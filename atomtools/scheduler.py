@@ -0,0 +1,287 @@
+"""
+local scheduler for calculations
+
+runs external commands with declared cores/memory side by side on the
+cores and memory of the allocation (see system.get_cpu_limit and
+system.get_maxmem), tracks them through the status.Status states and
+persists the queue as JSON so that a restarted scheduler picks it up
+
+>>> scheduler = LocalScheduler('queue.json', cores=4, memory='16GB')
+>>> scheduler.submit('g16 a.gjf', cores=4, memory='8GB')
+>>> scheduler.run()
+"""
+import os
+import re
+import json
+import time
+import shlex
+import signal
+import subprocess
+import psutil
+import modlog
+
+from . import system
+from .status import Status
+
+
+POLL_INTERVAL = 1.0
+# seconds a cancelled job has to exit after SIGTERM before SIGKILL
+CANCEL_TIMEOUT = 10
+STATE_DIR_SUFFIX = '.d'
+MEMORY_REGEXP = re.compile(r'^\s*(\d+\.?\d*)\s*([kmgt]b)?\s*$', re.I)
+
+
+logger = modlog.getLogger(__name__)
+
+
+def parse_memory(memory):
+    """bytes of 1024/'2GB'/'512 MB', numbers are bytes"""
+    if isinstance(memory, (int, float)):
+        return int(memory)
+    res = MEMORY_REGEXP.match(memory)
+    if not res:
+        raise ValueError(f'invalid memory {memory}')
+    return int(float(res[1]) * (system.kmg_unit(res[2]) if res[2] else 1))
+
+
+def _job_alive(job):
+    """the process of job still runs (not a zombie, not a reused pid)"""
+    try:
+        process = psutil.Process(job.pid)
+        return process.status() != psutil.STATUS_ZOMBIE and \
+            process.create_time() <= (job.start_time or 0) + 1
+    except (psutil.Error, ValueError, TypeError):
+        return False
+
+
+def _terminate_group(job, process=None, timeout=CANCEL_TIMEOUT):
+    """
+    SIGTERM, then SIGKILL after timeout, the process group of a job and
+    wait until its processes exited (and are reaped)
+    """
+    try:
+        procs = [psutil.Process(job.pid)]
+        procs += procs[0].children(recursive=True)
+    except psutil.Error:
+        procs = []
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(job.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+        if process is not None:
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                continue
+        if not psutil.wait_procs(procs, timeout)[1]:
+            return True
+    logger.warning(f'{job} did not exit after SIGKILL')
+    return False
+
+
+class Job(object):
+    """a command with its needs and status"""
+
+    __slots__ = ('name', 'command', 'cores', 'memory', 'workdir', 'status',
+                 'returncode', 'pid', 'start_time', 'end_time')
+
+    def __init__(self, name, command, cores=1, memory=0, workdir=None,
+                 status=Status.unfinished, returncode=None, pid=None,
+                 start_time=None, end_time=None):
+        self.name = name
+        self.command = command
+        self.cores = cores
+        self.memory = parse_memory(memory)
+        self.workdir = os.path.abspath(workdir or os.getcwd())
+        self.status = status
+        self.returncode = returncode
+        self.pid = pid
+        self.start_time = start_time
+        self.end_time = end_time
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self):
+        return 'Job({0}, {1}, cores={2}, status={3})'.format(
+            self.name, self.command, self.cores, self.status)
+
+
+class LocalScheduler(object):
+    """
+    first-fit packing of the queued jobs, in submission order, onto the
+    free cores and memory; smaller jobs may pass a job that does not fit
+    """
+
+    def __init__(self, queue_file='atomtools_queue.json', cores=None,
+                 memory=None, poll_interval=POLL_INTERVAL):
+        self.queue_file = os.path.abspath(queue_file)
+        self.state_dir = self.queue_file + STATE_DIR_SUFFIX
+        self.cores = cores or system.get_cpu_limit()
+        self.memory = parse_memory(memory) if memory is not None \
+            else int(system.get_maxmem())
+        self.poll_interval = poll_interval
+        self.jobs = dict()
+        self._processes = dict()
+        if not os.path.exists(self.state_dir):
+            os.makedirs(self.state_dir)
+        self.load()
+
+    def _state_file(self, job, extension):
+        return os.path.join(self.state_dir, f'{job.name}.{extension}')
+
+    def load(self):
+        """
+        read the queue file; jobs left running by a previous scheduler
+        are finished from their exit code file, adopted while their
+        process is alive, and queued again otherwise. Queued jobs larger
+        than this allocation are stopped.
+        """
+        if not os.path.exists(self.queue_file):
+            return
+        with open(self.queue_file) as fd:
+            for item in json.load(fd):
+                job = Job(**item)
+                self.jobs[job.name] = job
+                if job.status == Status.running and \
+                        not self._finish_from_file(job) and \
+                        not _job_alive(job):
+                    logger.warning(f'{job.name} was lost, queued again')
+                    job.status, job.pid = Status.unfinished, None
+                if job.status == Status.unfinished and \
+                        (job.cores > self.cores or job.memory > self.memory):
+                    logger.warning(f'{job} needs more than {self.cores} '
+                                   f'cores and {self.memory} bytes, stopped')
+                    job.status, job.end_time = Status.stopped, time.time()
+
+    def save(self):
+        """write the queue file atomically"""
+        tmpfile = self.queue_file + '.tmp'
+        with open(tmpfile, 'w') as fd:
+            json.dump([job.to_dict() for job in self.jobs.values()], fd,
+                      indent=1)
+        os.replace(tmpfile, self.queue_file)
+
+    def submit(self, command, cores=1, memory=0, name=None, workdir=None):
+        if name is None:
+            index = len(self.jobs)
+            while f'job{index}' in self.jobs:
+                index += 1
+            name = f'job{index}'
+        if name in self.jobs:
+            raise ValueError(f'job {name} exists')
+        job = Job(name, command, cores, memory, workdir)
+        if job.cores > self.cores or job.memory > self.memory:
+            raise ValueError(f'{job} needs more than {self.cores} cores '
+                             f'and {self.memory} bytes')
+        self.jobs[name] = job
+        self.save()
+        return job
+
+    def cancel(self, name):
+        """
+        stop a job, a running one is waited for so that its cores and
+        memory are only freed once it exited
+        """
+        job = self.jobs[name]
+        if job.status == Status.running:
+            process = self._processes.pop(name, None)
+            if process is not None or _job_alive(job):
+                _terminate_group(job, process)
+            if process is not None:
+                job.returncode = process.returncode
+        if job.status in (Status.running, Status.unfinished):
+            job.status, job.end_time = Status.stopped, time.time()
+        self.save()
+
+    def get_jobs(self, status):
+        return [job for job in self.jobs.values() if job.status == status]
+
+    def free_resources(self):
+        """(cores, memory) not declared by running jobs"""
+        running = self.get_jobs(Status.running)
+        return (self.cores - sum(job.cores for job in running),
+                self.memory - sum(job.memory for job in running))
+
+    def _launch(self, job):
+        """start a job, a job which can not be started is an error"""
+        try:
+            self._start(job)
+        except OSError as err:
+            logger.error(f'{job} not started: {err}')
+            job.status, job.pid = Status.error, None
+            job.returncode, job.end_time = None, time.time()
+            return False
+        return True
+
+    def _start(self, job):
+        exitcode_file = self._state_file(job, 'exitcode')
+        if os.path.exists(exitcode_file):
+            os.remove(exitcode_file)
+        # the exit code survives a restart of the scheduler, the subshell
+        # keeps an exit in the command from skipping it
+        script = '(\n{0}\n)\necho $? > {1}'.format(
+            job.command, shlex.quote(exitcode_file))
+        env = dict(os.environ, OMP_NUM_THREADS=str(job.cores))
+        with open(self._state_file(job, 'log'), 'ab') as log:
+            process = subprocess.Popen(
+                ['/bin/sh', '-c', script], cwd=job.workdir, env=env,
+                stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        self._processes[job.name] = process
+        job.status, job.pid = Status.running, process.pid
+        job.start_time, job.returncode = time.time(), None
+        logger.debug(f'{job} started')
+
+    def _finish_from_file(self, job):
+        """set the status of a job from its exit code file"""
+        try:
+            with open(self._state_file(job, 'exitcode')) as fd:
+                job.returncode = int(fd.read())
+        except (OSError, ValueError):
+            return False
+        job.status = Status.complete if job.returncode == 0 else Status.error
+        job.end_time = job.end_time or time.time()
+        return True
+
+    def poll(self):
+        """update the running jobs"""
+        for job in self.get_jobs(Status.running):
+            process = self._processes.get(job.name)
+            if process is not None:
+                if process.poll() is None:
+                    continue
+                del self._processes[job.name]
+            elif _job_alive(job):
+                # adopted from a previous scheduler
+                continue
+            if not self._finish_from_file(job):
+                # killed before the exit code was written
+                job.status, job.end_time = Status.stopped, time.time()
+                job.returncode = process.returncode if process else None
+            logger.debug(f'{job} finished')
+
+    def step(self):
+        """poll the running jobs and start the queued jobs which fit"""
+        self.poll()
+        cores, memory = self.free_resources()
+        for job in self.get_jobs(Status.unfinished):
+            if job.cores <= cores and job.memory <= memory and \
+                    self._launch(job):
+                cores, memory = cores - job.cores, memory - job.memory
+        self.save()
+
+    def run(self, timeout=None):
+        """run until all jobs are finished, return the jobs"""
+        start = time.time()
+        while True:
+            self.step()
+            if not self.get_jobs(Status.running):
+                # with nothing running every queued job that fits started
+                for job in self.get_jobs(Status.unfinished):
+                    logger.warning(f'{job} does not fit, left unfinished')
+                break
+            if timeout is not None and time.time() - start > timeout:
+                break
+            time.sleep(self.poll_interval)
+        return list(self.jobs.values())
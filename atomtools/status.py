@@ -7,7 +7,17 @@ complete
 stopped
 
 
+StatusMonitor decides the status of output files by their [status]
+regexps of default_filetype.conf, every poll reads only the bytes
+appended since the last one
 """
+import os
+import re
+import time
+import functools
+
+from . import filetype
+from . import fileutil
 
 
 # from enum import Enum
@@ -26,3 +36,121 @@ class Status:
     running = 'running'
     stopped = 'stopped'
     unfinished = 'unfinished'
+
+
+# a complete/error match counts only if at most so many bytes follow it,
+# so a multi-step job (gaussian --Link1--) runs again after a step ends
+TERMINAL_TAIL_LENGTH = 8192
+# bytes of the previous poll searched again, for matches across polls
+OVERLAP_LENGTH = 1024
+SCAN_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_status_rules(value):
+    rules = []
+    for status, regexp in zip((Status.complete, Status.error),
+                              value.split('&&')):
+        if regexp.strip():
+            rules.append((status, re.compile(regexp.strip().encode(),
+                                             re.MULTILINE)))
+    return tuple(rules)
+
+
+def get_status_rules(ftype):
+    """[(Status.complete/error, compiled bytes regexp)] of ftype"""
+    value = filetype.STATUS_REGEXP.get(ftype)
+    return _compile_status_rules(value) if value else ()
+
+
+class _FileState(object):
+
+    __slots__ = ('inode', 'ftype', 'offset', 'carry', 'status', 'match_end')
+
+    def __init__(self, inode, ftype=None):
+        self.inode = inode
+        self.ftype = ftype
+        self.offset = 0
+        self.carry = b''
+        self.status = None
+        self.match_end = 0
+
+
+class StatusMonitor(object):
+    """
+    incremental status of output files
+
+    >>> monitor = StatusMonitor()
+    >>> monitor.poll('a.log')
+    'running'
+    >>> monitor.poll('a.log')  # reads only what was appended
+    'complete'
+
+    a file truncated or replaced since the last poll is scanned again,
+    files without [status] regexps are running or stopped
+    """
+
+    def __init__(self, max_active_time=None):
+        self.max_active_time = max_active_time or fileutil.MAX_ACTIVE_TIME
+        self._states = dict()
+
+    def forget(self, filename):
+        self._states.pop(fileutil.get_absfilename(filename), None)
+
+    def _scan(self, filename, state, size):
+        rules = get_status_rules(state.ftype)
+        with open(filename, 'rb') as fd:
+            fd.seek(state.offset)
+            while state.offset < size:
+                block = fd.read(min(SCAN_BLOCK_SIZE, size - state.offset))
+                if not block:
+                    break
+                data = state.carry + block
+                base = state.offset - len(state.carry)
+                for status, regexp in rules:
+                    match = None
+                    for match in regexp.finditer(data):
+                        pass
+                    if match and base + match.end() > state.match_end:
+                        state.status = status
+                        state.match_end = base + match.end()
+                state.offset += len(block)
+                state.carry = data[-OVERLAP_LENGTH:]
+
+    def poll(self, filename, ftype=None):
+        """
+        input:
+            filename: output file
+            ftype: its filetype, default detected once by filetype.filetype
+        output:
+            Status.complete/error/running/stopped, Status.unfinished if
+            the file does not exist
+        """
+        filename = fileutil.get_absfilename(filename)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            self._states.pop(filename, None)
+            return Status.unfinished
+        state = self._states.get(filename)
+        if state is None or state.inode != stat.st_ino or \
+                stat.st_size < state.offset:
+            state = _FileState(stat.st_ino, ftype)
+            self._states[filename] = state
+        if state.ftype is None:
+            ftype = filetype.filetype(filename)
+            # the head of a new file may not identify it yet
+            if ftype is not None or stat.st_size >= filetype.PARTIAL_LENGTH:
+                state.ftype = ftype or ''
+        if state.ftype and stat.st_size > state.offset:
+            self._scan(filename, state, stat.st_size)
+        if state.status is not None and \
+                stat.st_size - state.match_end <= TERMINAL_TAIL_LENGTH:
+            return state.status
+        if time.time() - stat.st_mtime <= self.max_active_time:
+            return Status.running
+        return Status.stopped
+
+    def poll_many(self, filenames):
+        """{filename: status}"""
+        return {filename: self.poll(filename) for filename in filenames}
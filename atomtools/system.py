@@ -1,8 +1,14 @@
 """
 get max cores and memory for linux
 
+the limits of the allocation are honored: cpu affinity, cgroup v1/v2 cpu
+quota and memory limit, and the cores/memory given by job schedulers
+(SLURM, PBS, SGE, LSF)
 """
+import os
 import sys
+import math
+import time
 import psutil
 
 
@@ -25,12 +31,192 @@ def kmg_unit(unit):
     return num
 
 
-def get_maxcore():
-    return round(psutil.cpu_count()*(1-psutil.cpu_percent()/100))
+CGROUP_ROOT = '/sys/fs/cgroup'
+PROC_CGROUP = '/proc/self/cgroup'
+# environment variables with the number of cores of a batch job
+SCHEDULER_CORE_ENVS = [
+    'SLURM_CPUS_PER_TASK',  # SLURM, -c
+    'SLURM_CPUS_ON_NODE',
+    'NCPUS',  # PBS Pro
+    'PBS_NUM_PPN',  # Torque
+    'NSLOTS',  # SGE
+    'LSB_DJOB_NUMPROC',  # LSF
+]
+# time constant (s) of the smoothed load
+LOAD_TIME_CONSTANT = 30.
+# first sample of the load
+LOAD_SAMPLE_INTERVAL = 0.1
+_LOAD_STATE = dict()
+
+
+def _read_text(path):
+    try:
+        with open(path) as fd:
+            return fd.read().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def _cgroup_dirs(controller):
+    """
+    directories of the cgroup of this process for controller (v1) or of
+    the unified hierarchy (controller None), innermost first
+    """
+    content = _read_text(PROC_CGROUP) or ''
+    dirs = []
+    for line in content.splitlines():
+        _, controllers, path = line.split(':', 2)
+        if controller is None and controllers == '':
+            mounts = [CGROUP_ROOT, os.path.join(CGROUP_ROOT, 'unified')]
+        elif controller is not None and controller in controllers.split(','):
+            mounts = [os.path.join(CGROUP_ROOT, controllers),
+                      os.path.join(CGROUP_ROOT, controller)]
+        else:
+            continue
+        for mount in mounts:
+            # inside a cgroup namespace the mount root is the own cgroup
+            for subpath in (path.lstrip('/'), ''):
+                dirname = os.path.join(mount, subpath)
+                if os.path.isdir(dirname) and dirname not in dirs:
+                    dirs.append(dirname)
+    return dirs
+
+
+def _cgroup_value(controller, filename):
+    for dirname in _cgroup_dirs(controller):
+        value = _read_text(os.path.join(dirname, filename))
+        if value is not None:
+            return value
+    return None
+
+
+def get_affinity_cores():
+    """number of cores this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return psutil.cpu_count() or 1
+
+
+def get_cgroup_cpu_limit():
+    """cpu quota of the cgroup in cores, None if unlimited"""
+    value = _cgroup_value(None, 'cpu.max')
+    if value is not None:
+        quota, period = (value.split() + ['100000'])[:2]
+        if quota == 'max':
+            return None
+        return int(quota) / int(period)
+    quota = _cgroup_value('cpu', 'cpu.cfs_quota_us')
+    period = _cgroup_value('cpu', 'cpu.cfs_period_us')
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return int(quota) / int(period)
+
+
+def get_cgroup_memory():
+    """
+    output:
+        (limit, usage) in bytes of the cgroup, limit is None if unlimited
+    """
+    limit = _cgroup_value(None, 'memory.max')
+    if limit is not None:
+        usage = _cgroup_value(None, 'memory.current')
+    else:
+        limit = _cgroup_value('memory', 'memory.limit_in_bytes')
+        usage = _cgroup_value('memory', 'memory.usage_in_bytes')
+    if limit is None or limit == 'max' or \
+            int(limit) >= psutil.virtual_memory().total:
+        return None, None
+    return int(limit), int(usage or 0)
+
+
+def get_scheduler_cores():
+    """cores given by the job scheduler, None outside of batch jobs"""
+    for name in SCHEDULER_CORE_ENVS:
+        value = os.environ.get(name, '').split('(')[0]
+        if value.isdigit() and int(value) > 0:
+            return int(value)
+    return None
+
+
+def get_scheduler_memory():
+    """memory in bytes given by the job scheduler, None if unknown"""
+    if os.environ.get('SLURM_MEM_PER_NODE', '').isdigit():
+        return int(os.environ['SLURM_MEM_PER_NODE']) * kmg_unit('MB')
+    if os.environ.get('SLURM_MEM_PER_CPU', '').isdigit():
+        return int(os.environ['SLURM_MEM_PER_CPU']) * kmg_unit('MB') * \
+            (get_scheduler_cores() or 1)
+    return None
+
+
+def get_cpu_limit():
+    """cores of the allocation: affinity, cgroup quota and scheduler"""
+    limits = [get_affinity_cores(), get_scheduler_cores()]
+    quota = get_cgroup_cpu_limit()
+    if quota is not None:
+        limits.append(max(1, math.floor(quota)))
+    return min(x for x in limits if x)
+
+
+def _busy_seconds():
+    """cpu seconds used so far in the allocation"""
+    if get_cgroup_cpu_limit() is not None:
+        stat = _cgroup_value(None, 'cpu.stat')
+        if stat is not None:
+            usage = dict(line.split() for line in stat.splitlines())
+            return int(usage['usage_usec']) / 1e6
+        usage = _cgroup_value('cpuacct', 'cpuacct.usage')
+        if usage is not None:
+            return int(usage) / 1e9
+    times = psutil.cpu_times(percpu=True)
+    cpus = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') \
+        else range(len(times))
+    busy = 0.
+    for cpu in cpus:
+        if cpu < len(times):
+            cpu_times = times[cpu]
+            busy += sum(cpu_times) - cpu_times.idle - \
+                getattr(cpu_times, 'iowait', 0)
+    return busy
+
+
+def get_load():
+    """
+    busy cores of the allocation, exponentially smoothed over
+    LOAD_TIME_CONSTANT seconds between calls
+    """
+    now, busy = time.time(), _busy_seconds()
+    if not _LOAD_STATE:
+        time.sleep(LOAD_SAMPLE_INTERVAL)
+        _LOAD_STATE.update(time=now, busy=busy)
+        now, busy = time.time(), _busy_seconds()
+    interval = now - _LOAD_STATE['time']
+    if interval <= 0:
+        return _LOAD_STATE['load']
+    load = max(0., (busy - _LOAD_STATE['busy']) / interval)
+    if 'load' in _LOAD_STATE:
+        weight = 1 - math.exp(-interval / LOAD_TIME_CONSTANT)
+        load = _LOAD_STATE['load'] + weight * (load - _LOAD_STATE['load'])
+    _LOAD_STATE.update(time=now, busy=busy, load=load)
+    return load
+
+
+def get_maxcore(use_load=True):
+    """free cores of the allocation, at least 1"""
+    ncores = get_cpu_limit()
+    if use_load:
+        ncores -= get_load()
+    return max(1, round(ncores))
 
 
 def get_maxmem(unit=None):
-    mem = psutil.virtual_memory().available * 0.9
+    mem = psutil.virtual_memory().available
+    limit, usage = get_cgroup_memory()
+    if limit is not None:
+        mem = min(mem, limit - usage)
+    scheduler_mem = get_scheduler_memory()
+    if scheduler_mem is not None:
+        mem = min(mem, scheduler_mem)
+    mem = max(mem, 0) * 0.9
     if unit:
         return mem / kmg_unit(unit)
     return mem
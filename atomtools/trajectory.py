@@ -0,0 +1,209 @@
+"""
+compact trajectory: positions, cells, numbers and per-frame scalars in
+contiguous numpy arrays
+
+the geo batch functions (get_batch_distances, ...) accept a Trajectory
+but ignore its cells and pbc; its frames have positions/cell/numbers/pbc
+like an Atoms object and go to the single frame functions
+(get_distance_matrix, ...), which reject a whole Trajectory
+"""
+import os
+import numpy as np
+
+
+MIN_CAPACITY = 16
+SCALAR_PREFIX = 'scalar.'
+
+
+class Frame(object):
+    """one frame of a Trajectory, the arrays are views"""
+
+    __slots__ = ('positions', 'cell', 'numbers', 'pbc', 'scalars')
+
+    def __init__(self, positions, cell, numbers, pbc, scalars):
+        self.positions = positions
+        self.cell = cell
+        self.numbers = numbers
+        self.pbc = pbc
+        self.scalars = scalars
+
+    def __repr__(self):
+        return 'Frame(natoms={0}, {1})'.format(len(self.numbers), self.scalars)
+
+
+class Trajectory(object):
+    """
+    frames of the same atoms
+
+    >>> traj = Trajectory([8, 1, 1])
+    >>> traj.append(positions, energy=-76.4)
+    >>> traj.positions.shape
+    (1, 3, 3)
+    >>> traj[::10]  # no copy
+    >>> traj.save('traj'); Trajectory.load('traj')  # memory-mapped
+    """
+
+    __slots__ = ('numbers', 'pbc', '_positions', '_cells', '_scalars',
+                 '_nframes')
+
+    def __init__(self, numbers, positions=None, cells=None, pbc=False,
+                 **scalars):
+        self.numbers = np.asarray(numbers, dtype=int)
+        self.pbc = np.ones(3, dtype=bool) & np.asarray(pbc, dtype=bool)
+        natoms = len(self.numbers)
+        self._positions = np.empty((0, natoms, 3))
+        self._cells = None
+        self._scalars = dict()
+        self._nframes = 0
+        if positions is not None:
+            self.extend(positions, cells, **scalars)
+
+    @classmethod
+    def _from_arrays(cls, numbers, pbc, positions, cells, scalars):
+        """trajectory on existing arrays, nothing is copied"""
+        traj = cls.__new__(cls)
+        traj.numbers, traj.pbc = numbers, pbc
+        traj._positions, traj._cells = positions, cells
+        traj._scalars, traj._nframes = scalars, len(positions)
+        return traj
+
+    @classmethod
+    def from_atoms_arrays(cls, frames):
+        """
+        from a list of arrays dicts or a methods.PackedAtomsArrays, the
+        numbers and pbc of the first frame are used
+        """
+        from .methods import PackedAtomsArrays, pack_atoms_arrays
+        if not isinstance(frames, PackedAtomsArrays):
+            frames = pack_atoms_arrays(frames)
+        arrays = frames.arrays
+        scalars = {key: val for key, val in arrays.items()
+                   if val.ndim == 1 and key not in ('numbers', 'pbc')}
+        return cls(arrays['numbers'][0], arrays['positions'],
+                   arrays.get('cell'),
+                   arrays['pbc'][0] if 'pbc' in arrays else False, **scalars)
+
+    def __len__(self):
+        return self._nframes
+
+    @property
+    def natoms(self):
+        return len(self.numbers)
+
+    @property
+    def capacity(self):
+        return len(self._positions)
+
+    @property
+    def positions(self):
+        """(nframes, natoms, 3) view"""
+        return self._positions[:self._nframes]
+
+    @property
+    def cells(self):
+        """(nframes, 3, 3) view, None if no cell was given"""
+        return None if self._cells is None else self._cells[:self._nframes]
+
+    @property
+    def scalars(self):
+        """name -> (nframes,) views"""
+        return {key: val[:self._nframes] for key, val in self._scalars.items()}
+
+    def _reserve(self, nframes):
+        """make room for nframes, growing geometrically"""
+        if nframes <= self.capacity:
+            return
+        capacity = max(nframes, 2 * self.capacity, MIN_CAPACITY)
+
+        def grow(array, fill=0):
+            new = np.full((capacity,) + array.shape[1:], fill,
+                          dtype=array.dtype)
+            new[:self._nframes] = array[:self._nframes]
+            return new
+        self._positions = grow(self._positions)
+        if self._cells is not None:
+            self._cells = grow(self._cells)
+        for key, val in self._scalars.items():
+            self._scalars[key] = grow(val, np.nan)
+
+    def extend(self, positions, cells=None, **scalars):
+        """
+        append frames
+            positions: (nframes, natoms, 3)
+            cells: (nframes, 3, 3) or (3, 3) for all
+            scalars: name=(nframes,) values, missing frames are nan
+        """
+        positions = np.asarray(positions, dtype=float)
+        if positions.ndim == 2:
+            positions = positions[np.newaxis]
+        assert positions.shape[1:] == (self.natoms, 3), \
+            'positions should be (nframes, {0}, 3)'.format(self.natoms)
+        start, stop = self._nframes, self._nframes + len(positions)
+        self._reserve(stop)
+        if cells is not None and self._cells is None:
+            self._cells = np.zeros((self.capacity, 3, 3))
+        for key in scalars:
+            if key not in self._scalars:
+                self._scalars[key] = np.full(self.capacity, np.nan)
+        self._positions[start:stop] = positions
+        if cells is not None:
+            self._cells[start:stop] = np.asarray(cells, dtype=float)
+        for key, val in scalars.items():
+            self._scalars[key][start:stop] = val
+        self._nframes = stop
+
+    def append(self, positions, cell=None, **scalars):
+        """append one frame, amortized O(1)"""
+        self.extend(np.asarray(positions, dtype=float)[np.newaxis],
+                    None if cell is None else np.asarray(cell)[np.newaxis],
+                    **{key: [val] for key, val in scalars.items()})
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            index = range(self._nframes)[index]
+            cell = None if self._cells is None else self._cells[index]
+            return Frame(self._positions[index], cell, self.numbers,
+                         self.pbc, {key: val[index] for key, val
+                                    in self._scalars.items()})
+        # slices and index arrays, slices are views
+        cells = self.cells
+        return self._from_arrays(
+            self.numbers, self.pbc, self.positions[index],
+            None if cells is None else cells[index],
+            {key: val[index] for key, val in self.scalars.items()})
+
+    def __iter__(self):
+        for i in range(self._nframes):
+            yield self[i]
+
+    def save(self, dirname):
+        """save the arrays as .npy files in the directory dirname"""
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        arrays = {'numbers': self.numbers, 'pbc': self.pbc,
+                  'positions': self.positions}
+        if self._cells is not None:
+            arrays['cells'] = self.cells
+        for key, val in self.scalars.items():
+            arrays[SCALAR_PREFIX + key] = val
+        for key, val in arrays.items():
+            np.save(os.path.join(dirname, key + '.npy'), val)
+
+    @classmethod
+    def load(cls, dirname, mmap_mode='r'):
+        """load a saved trajectory, memory-mapped unless mmap_mode is None"""
+        def load_array(name):
+            return np.load(os.path.join(dirname, name + '.npy'),
+                           mmap_mode=mmap_mode)
+        scalars = dict()
+        for filename in sorted(os.listdir(dirname)):
+            if filename.startswith(SCALAR_PREFIX) and \
+                    filename.endswith('.npy'):
+                key = filename[len(SCALAR_PREFIX):-len('.npy')]
+                scalars[key] = load_array(SCALAR_PREFIX + key)
+        has_cells = os.path.exists(os.path.join(dirname, 'cells.npy'))
+        return cls._from_arrays(
+            np.load(os.path.join(dirname, 'numbers.npy')),
+            np.load(os.path.join(dirname, 'pbc.npy')),
+            load_array('positions'),
+            load_array('cells') if has_cells else None, scalars)
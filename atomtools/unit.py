@@ -2,6 +2,10 @@
 unit transformation using in quantum chemistry
 
 """
+import re
+import functools
+import numpy as np
+
 
 ATOMIC_UNIT = 'au'
 
@@ -69,6 +73,20 @@ UNITS = {
 
 ZERO_Kelvin = 273.15
 
+# dimension of every kind of unit as powers of (length, mass, time),
+# mol is a plain number
+UNIT_DIMENSIONS = {
+    "LENGTH_UNITS": (1, 0, 0),
+    "MASS_UNITS": (0, 1, 0),
+    "TIME_UNITS": (0, 0, 1),
+    "ENERGY_UNITS": (2, 1, -2),
+    "NUMBER_UNITS": (0, 0, 0),
+    "PRESSURE_UNITS": (-1, 1, -2),
+}
+# one factor of a unit expression: [*|/] name [^power|**power]
+UNIT_FACTOR_REGEXP = re.compile(
+    r'\s*([*/])?\s*([a-z]\w*|1)\s*(?:(?:\^|\*\*)\s*([+-]?\d+))?\s*')
+
 
 def get_atomic_unit(length):
     if length == 1:
@@ -76,6 +94,99 @@ def get_atomic_unit(length):
     return [ATOMIC_UNIT] * length
 
 
+@functools.lru_cache(maxsize=None)
+def _unit_symbols():
+    """name -> (SI factor, dimension) of every unit except au"""
+    symbols = dict()
+    for unit_type, unit_units in UNITS.items():
+        for name, factor in unit_units.items():
+            if name != ATOMIC_UNIT:
+                symbols[name] = (float(factor), UNIT_DIMENSIONS[unit_type])
+    return symbols
+
+
+def _atomic_unit_factor(dimension):
+    """SI factor of the atomic unit of dimension (bohr, m_e, t_au)"""
+    base = [UNITS[x][ATOMIC_UNIT] for x in
+            ("LENGTH_UNITS", "MASS_UNITS", "TIME_UNITS")]
+    return float(np.prod(np.power(base, dimension)))
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_unit(expr):
+    """
+    parse products, quotients and powers of units
+
+    >>> parse_unit('kcal/mol/ang^2')[1]
+    (0, 1, -2)
+
+    output:
+        (SI factor, dimension as powers of length, mass, time)
+        or (None, None) for au, the atomic unit of the other side
+    """
+    if not isinstance(expr, str):
+        raise ValueError(f"unit {expr} should be a string")
+    expr = expr.strip().lower()
+    if expr == ATOMIC_UNIT:
+        return None, None
+    symbols = _unit_symbols()
+    factor, dimension = 1., np.zeros(3, dtype=int)
+    pos = 0
+    while pos < len(expr):
+        res = UNIT_FACTOR_REGEXP.match(expr, pos)
+        if not res or (pos == 0) != (res[1] is None):
+            raise ValueError(f"invalid unit expression {expr} at {pos}")
+        if res[2] not in symbols:
+            raise ValueError(f"unknown unit {res[2]} in {expr}, au can only "
+                             "be used as the whole unit")
+        power = int(res[3] or 1) * (-1 if res[1] == '/' else 1)
+        name_factor, name_dimension = symbols[res[2]]
+        factor *= name_factor ** power
+        dimension += power * np.array(name_dimension)
+        pos = res.end()
+    if pos == 0:
+        raise ValueError("empty unit expression")
+    return factor, tuple(int(x) for x in dimension)
+
+
+@functools.lru_cache(maxsize=1024)
+def get_conversion_factor(src, dest):
+    """
+    factor converting values in src into dest
+
+    >>> abs(get_conversion_factor('hartree/bohr', 'eV/ang') - 51.42208) < 1e-4
+    True
+    """
+    src_factor, src_dimension = parse_unit(src)
+    dest_factor, dest_dimension = parse_unit(dest)
+    if src_factor is None and dest_factor is None:
+        return 1.
+    if src_factor is None:
+        src_factor, src_dimension = \
+            _atomic_unit_factor(dest_dimension), dest_dimension
+    if dest_factor is None:
+        dest_factor, dest_dimension = \
+            _atomic_unit_factor(src_dimension), src_dimension
+    if src_dimension != dest_dimension:
+        raise ValueError(f"can not convert {src} {src_dimension} to "
+                         f"{dest} {dest_dimension}")
+    return src_factor / dest_factor
+
+
+def convert(array, src, dest, inplace=False):
+    """
+    convert array from src unit into dest unit with one multiplication
+        input:
+            array: number/list/np.ndarray
+            inplace: scale the float ndarray array itself
+    """
+    factor = get_conversion_factor(src, dest)
+    if inplace:
+        return np.multiply(array, factor, out=array)
+    return np.multiply(array, factor)
+
+
+@functools.lru_cache(maxsize=1024)
 def trans_basic_unit(src, dest, unit):
     """
     general function for unit transformation
@@ -137,6 +248,7 @@ def trans_temperature(number, src=None, dest='K'):
     return number
 
 
+@functools.lru_cache(maxsize=1024)
 def trans_length(src, dest="Ang"):
     """
     >>> abs(trans_length("ang") - 1.) < 1e-5
@@ -149,6 +261,7 @@ def trans_length(src, dest="Ang"):
     return trans_basic_unit(src, dest, unit="length")
 
 
+@functools.lru_cache(maxsize=1024)
 def trans_time(src, dest="fs"):
     """
     >>> abs(trans_time("ps") - 1E3) < 1e-5
@@ -161,6 +274,7 @@ def trans_time(src, dest="fs"):
     return trans_basic_unit(src, dest, unit="time")
 
 
+@functools.lru_cache(maxsize=1024)
 def trans_abs_energy(src, dest="eV"):
     """
     >>> abs(trans_abs_energy("ev") - 1.) < 1e-5
@@ -173,6 +287,36 @@ def trans_abs_energy(src, dest="eV"):
     return trans_basic_unit(src, dest, unit="energy")
 
 
+def _has_atomic_segment(*units):
+    """au used inside a compound unit like bohr/au"""
+    return any(unit.strip().lower() != ATOMIC_UNIT and ATOMIC_UNIT in
+               [x.strip() for x in unit.lower().split('/')] for unit in units)
+
+
+def _trans_segments(src, dest, unit_types):
+    """
+    transform src/dest of unit_types segment by segment, au in a compound
+    is the atomic unit of its segment
+    """
+    src = _split_segments(src, unit_types)
+    dest = _split_segments(dest, unit_types)
+    factor = trans_basic_unit(src[0], dest[0], unit_types[0])
+    for src_unit, dest_unit, unit in zip(src[1:], dest[1:], unit_types[1:]):
+        factor /= trans_basic_unit(src_unit, dest_unit, unit)
+    return factor
+
+
+def _split_segments(unit, unit_types):
+    if unit.strip().lower() == ATOMIC_UNIT:
+        return [ATOMIC_UNIT if ATOMIC_UNIT in UNITS[x.upper()+"_UNITS"]
+                else '1' for x in unit_types]
+    segments = [x.strip() for x in unit.split('/')]
+    segments += ['1'] * (len(unit_types) - len(segments))
+    assert len(segments) == len(unit_types), \
+        f"{unit} should be a {'/'.join(unit_types)} unit"
+    return segments
+
+
 def trans_energy(src, dest="eV"):
     """
     >>> abs(trans_energy("hartree") - 27.211386245988653) < 1e-5
@@ -182,59 +326,36 @@ def trans_energy(src, dest="eV"):
     >>> abs(trans_energy("kcal/mol", "au") - 1/627.50) < 1e-5
     True
     """
-    src = (src+'/1').split("/")[:2]
-    dest = (dest+'/1').split("/")[:2]
-    return trans_basic_unit(src[0], dest[0], "energy") / trans_basic_unit(src[1], dest[1], "number")
+    if _has_atomic_segment(src, dest):
+        return _trans_segments(src, dest, ("energy", "number"))
+    return get_conversion_factor(src, dest)
 
 
 def trans_velocity(src, dest="ang/ps"):
     """
-    >>> abs(trans_velocity("hartree") - 27.211386245988653) < 1e-5
-    True
-    >>> abs(trans_velocity("kJ/mol", "eV") - 1/96.485) < 1e-5
+    >>> abs(trans_velocity("au", "ang/fs") - 21.876912) < 1e-5
     True
-    >>> abs(trans_velocity("kcal/mol", "au") - 1/627.50) < 1e-5
+    >>> abs(trans_velocity("m/s", "ang/ps") - 1e-2) < 1e-10
     True
     """
-    SEG_LENGTH = 2
-    if src == ATOMIC_UNIT:
-        src = get_atomic_unit(SEG_LENGTH)
-    else:
-        src = src.split("/")
-    assert len(src) == SEG_LENGTH
-
-    if dest == ATOMIC_UNIT:
-        dest = [dest] * SEG_LENGTH
-    else:
-        dest = dest.split("/")
-    assert len(dest) == SEG_LENGTH
-    return trans_basic_unit(src[0], dest[0], "length") / trans_basic_unit(src[1], dest[1], "time")
+    if _has_atomic_segment(src, dest):
+        return _trans_segments(src, dest, ("length", "time"))
+    return get_conversion_factor(src, dest)
 
 
 def trans_force(src, dest="eV/Ang"):
     """
-    >>> abs(trans_velocity("hartree") - 27.211386245988653) < 1e-5
-    True
-    >>> abs(trans_velocity("kJ/mol", "eV") - 1/96.485) < 1e-5
+    >>> abs(trans_force("hartree/bohr") - 51.422067) < 1e-5
     True
-    >>> abs(trans_velocity("kcal/mol", "au") - 1/627.50) < 1e-5
+    >>> abs(trans_force("kcal/mol/ang", "au") - 1/1185.8210) < 1e-8
     True
     """
-    SEG_LENGTH = 2
-    if src == ATOMIC_UNIT:
-        src = get_atomic_unit(SEG_LENGTH)
-    else:
-        src = src.split("/")
-    assert len(src) == SEG_LENGTH
-
-    if dest == ATOMIC_UNIT:
-        dest = [dest] * SEG_LENGTH
-    else:
-        dest = dest.split("/")
-    assert len(dest) == SEG_LENGTH
-    return trans_basic_unit(src[0], dest[0], "energy") / trans_basic_unit(src[1], dest[1], "length")
+    if _has_atomic_segment(src, dest):
+        return _trans_segments(src, dest, ("energy", "length"))
+    return get_conversion_factor(src, dest)
 
 
+@functools.lru_cache(maxsize=1024)
 def trans_pressure(src, dest="bar"):
     """
     >>>
@@ -61,6 +61,9 @@ if __name__ == '__main__':
             'curate': [
                 'graphviz'
             ],
+            'sparse': [
+                'scipy'
+            ],
         },
         include_package_data = True,
         zip_safe=False,
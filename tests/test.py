@@ -3,6 +3,11 @@ test atomtools
 """
 import os
 import glob
+import itertools
+import psutil
+import shutil
+import time
+import tempfile
 import numpy as np
 import ase.build
 
@@ -12,9 +17,17 @@ import ase.build
 import atomtools
 import atomtools.fileutil
 import atomtools.geo
+import atomtools.unit
 import atomtools.name
 import atomtools.ext_types
+import atomtools.methods
+import atomtools.trajectory
+import atomtools.system
+import atomtools.scheduler
+import atomtools.status
 import atomtools.filetype
+import atomtools.filetype_cache
+import atomtools.frameindex
 
 
 BASEDIR = os.path.dirname(os.path.abspath(__file__))
@@ -68,6 +81,73 @@ def test_get_distance_matrix():
     print(atomtools.geo.dist_change_matrix(test_cases[0]['positions'], 1))
 
 
+def test_get_neighbor_list():
+    positions = np.random.random((500, 3)) * 15
+    dist_matrix = atomtools.geo.get_distance_matrix(positions)
+    first, second = np.nonzero(np.triu(dist_matrix <= 2.0, k=1))
+    for method in ['brute', 'cell', 'tree']:
+        i, j, dists = atomtools.geo.get_neighbor_list(
+            positions, 2.0, method=method)
+        print(method, len(i))
+        assert (i == first).all() and (j == second).all()
+        assert np.allclose(dists, dist_matrix[i, j])
+    sparse_matrix = atomtools.geo.get_sparse_distance_matrix(positions, 2.0)
+    assert np.allclose(sparse_matrix.toarray(),
+                       np.where(dist_matrix <= 2.0, dist_matrix, 0))
+
+
+def test_find_mic():
+    cell = np.array([[5., 0., 0.], [4.6, 1.2, 0.], [3., 2., 4.]])
+    positions = np.random.random((40, 3)).dot(cell)
+    dist_matrix, offsets = atomtools.geo.get_distance_matrix(
+        Test_Atoms(positions, cell), return_offsets=True)
+    vectors = positions[np.newaxis] - positions[:, np.newaxis]
+    images = np.array(list(itertools.product(range(-6, 7), repeat=3)))
+    expected = np.min([np.linalg.norm(vectors + image.dot(cell), axis=-1)
+                       for image in images], axis=0)
+    assert np.allclose(dist_matrix, expected)
+    assert np.allclose(np.linalg.norm(vectors + offsets.dot(cell), axis=-1),
+                       dist_matrix)
+    i, j, dists = atomtools.geo.get_neighbor_list(
+        Test_Atoms(positions, cell), 1.5, method='cell')
+    print('periodic pairs', len(i))
+    assert np.allclose(dists, expected[i, j])
+    assert len(i) == np.triu(expected <= 1.5, k=1).sum()
+
+
+def test_batch_geometry():
+    trajectory = np.random.random((5, 6, 3)) * 3
+    indices = np.array(list(itertools.permutations(range(6), 4)))
+    distances = atomtools.geo.get_batch_distances(trajectory, indices[:, :2])
+    angles = atomtools.geo.get_batch_angles(trajectory, indices[:, :3])
+    dihedrals = atomtools.geo.get_batch_dihedrals(trajectory, indices)
+    print(distances.shape, angles.shape, dihedrals.shape)
+    for frame, frame_positions in enumerate(trajectory):
+        for m, (i, j, k, l) in enumerate(indices):
+            assert np.isclose(distances[frame, m], atomtools.geo.get_distance(
+                frame_positions, i, j))
+            assert np.isclose(angles[frame, m], atomtools.geo.get_angle(
+                frame_positions, i, j, k))
+            assert np.isclose(dihedrals[frame, m], atomtools.geo.get_dihedral(
+                frame_positions, i, j, k, l))
+
+
+def test_freq_dist_change_matrix():
+    positions = np.random.random((8, 3)) * 3
+    XX = np.random.random((24, 8, 3)) * 0.1
+    expected = np.array([atomtools.geo.get_distance_matrix(x + positions)
+                         for x in XX]) - \
+        atomtools.geo.get_distance_matrix(positions)
+    changes = atomtools.geo.freq_dist_change_matrix(
+        XX, positions, chunk_size=5)
+    assert np.allclose(changes, expected)
+    pairs = [[0, 1], [3, 7]]
+    out = np.zeros((24, 2))
+    atomtools.geo.freq_dist_change_matrix(XX, positions, pairs=pairs, out=out)
+    print(out[:3])
+    assert np.allclose(out, expected[:, [0, 3], [1, 7]])
+
+
 def test_zmat():
     """
     test zmat
@@ -118,6 +198,115 @@ def test_zmat():
         print(atomtools.geo.input_standard_pos_transform(**case))
 
 
+def test_cartesian_to_zmatrix_nearest():
+    positions = ase.build.molecule('C6H6').positions
+    zmatrix, variables, indices = atomtools.geo.cartesian_to_zmatrix(
+        positions, {'shown_length': [(0, 1), (0, 6)]}, reference='nearest')
+    print(zmatrix, variables)
+    for ai, ((a0, length), (a1, angle), (a2, dihedral)) in enumerate(zmatrix):
+        assert max(a0, a1, a2) < ai
+        if isinstance(length, str):
+            length = variables[length][1]
+        if ai >= 1:
+            assert np.isclose(length, atomtools.geo.get_distance(
+                positions, ai, a0))
+        if ai >= 2:
+            assert np.isclose(angle, atomtools.geo.get_angle(
+                positions, ai, a0, a1))
+        if ai >= 3:
+            assert np.isclose(dihedral, atomtools.geo.get_dihedral(
+                positions, ai, a0, a1, a2))
+    assert variables['R_0_6'][0] == (0, 6)
+    # atoms without earlier ones within cutoff: the growing nearest
+    # neighbor search finds the same references as the scan
+    geo = atomtools.geo
+    rng = np.random.default_rng(0)
+    positions = rng.random((500, 3)) * 50
+    tree = geo._nearest_tree(positions)
+    for ai in range(3, 500, 7):
+        args = (positions, ai, ai - 1, [ai - 2], (ai - 3, ai - 1))
+        assert geo._nearest_candidate(*args) == \
+            geo._nearest_candidate(*args, tree)
+        assert geo._nearest_candidate(positions, ai, ai, []) == \
+            geo._nearest_candidate(positions, ai, ai, [], tree=tree)
+
+
+def test_zmatrix_to_cartesian():
+    atoms = ase.build.molecule('CH3CH2OH')
+    zmatrix, variables, _ = atomtools.geo.cartesian_to_zmatrix(
+        atoms.positions, {'shown_length': [(0, 1)]}, reference='nearest',
+        standard_dihedral=True)
+    positions = atomtools.geo.zmatrix_to_cartesian(
+        zmatrix, variables, standard_dihedral=True)
+    assert np.allclose(atomtools.geo.get_distance_matrix(positions),
+                       atomtools.geo.get_distance_matrix(atoms))
+    conformers = atomtools.geo.zmatrix_to_cartesian(
+        zmatrix, [variables, {'R_0_1': 1.6}], standard_dihedral=True)
+    print(conformers.shape)
+    assert np.allclose(conformers[0], positions)
+    assert np.isclose(atomtools.geo.get_distance(conformers[1], 0, 1), 1.6)
+
+
+def test_kabsch():
+    reference = ase.build.molecule('CH3CH2OH').positions
+    rotation = atomtools.geo.get_rotation_matrix([1, 2, 3], 40)
+    frames = np.array([reference.dot(rotation) + shift
+                       for shift in np.random.random((5, 3))])
+    R, t = atomtools.geo.kabsch_batch(frames, reference)
+    assert np.allclose(R, rotation.T)
+    rmsd = atomtools.geo.get_rmsd(frames, reference)
+    print('rmsd', rmsd)
+    assert np.allclose(rmsd, 0)
+    t_vals = np.random.random((3, 3))
+    for kwargs in [{'is_coord': True}, {'std_to_inp': False}]:
+        assert np.allclose(
+            atomtools.geo.input_standard_pos_transform(
+                frames[0], reference, t_vals, **kwargs),
+            atomtools.geo.input_standard_pos_transform(
+                frames[0], reference, t_vals, method='kabsch', **kwargs))
+
+
+def _rodrigues_rotation_matrix(k, theta):
+    """the explicit formula of the old get_rotation_matrix, in degree"""
+    k = np.asarray(k, dtype=float) / np.linalg.norm(k)
+    theta = np.radians(theta)
+    k_cross = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]],
+                        [-k[1], k[0], 0]])
+    return np.identity(3) * np.cos(theta) + \
+        (1 - np.cos(theta)) * np.outer(k, k) + np.sin(theta) * k_cross
+
+
+def test_rotation_matrices():
+    geo = atomtools.geo
+    # known rotations
+    assert np.allclose(geo.get_rotation_matrix([0, 0, 1], 90),
+                       [[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+    assert np.allclose(geo.get_rotation_matrix([0, 0, 2], 90).dot([1, 0, 0]),
+                       [0, 1, 0])
+    assert np.allclose(geo.get_rotation_matrix([1, 0, 0], np.pi / 2,
+                                               radians=True).dot([0, 1, 0]),
+                       [0, 0, 1])
+    assert np.allclose(geo.get_rotation_matrix([1, 1, 1], 120).dot(
+        [1, 0, 0]), [0, 1, 0])
+    assert np.allclose(geo.get_rotation_matrices([[0, 0, 1], [0, 1, 0]],
+                                                 [180, 0]),
+                       [np.diag([-1, -1, 1]), np.identity(3)])
+    axes = np.random.random((4, 3))
+    angles = np.random.random(4) * 360
+    rotations = geo.get_rotation_matrices(axes, angles)
+    for axis, angle, rotation in zip(axes, angles, rotations):
+        assert np.allclose(rotation, _rodrigues_rotation_matrix(axis, angle))
+    assert geo.rotate_site_angle([[10, 20], [30, 40]], 1, 2) == \
+        [[11, 22], [31, 42]]
+    rotations = geo.random_rotation_matrices(4, rng=0)
+    assert np.allclose(np.linalg.det(rotations), 1)
+    positions = np.random.random((4, 6, 3))
+    expected = np.array([x.dot(R.T) for x, R in zip(positions, rotations)])
+    geo.rotate_positions(positions, rotations, out=positions)
+    print(positions[0])
+    assert np.allclose(positions, expected)
+
+
 def test_get_contact_matrix():
     # import atomse.io
     test_cases = [
@@ -139,6 +328,20 @@ def test_get_contact_matrix():
     ]
     for case in test_cases:
         print('get_contact_matrix', atomtools.geo.get_contact_matrix(**case))
+        dense = atomtools.geo.get_contact_matrix(**case)
+        sparse = atomtools.geo.get_contact_matrix(
+            **case, sparse='csr').toarray()
+        assert np.allclose(sparse[sparse != 0], dense[sparse != 0])
+    # periodic: both modes use minimum image distances
+    bulk = ase.build.bulk('Cu', cubic=True).repeat((2, 2, 2))
+    dense = atomtools.geo.get_contact_matrix(bulk)
+    sparse = atomtools.geo.get_contact_matrix(bulk, sparse='csr').toarray()
+    assert np.allclose(sparse[sparse != 0], dense[sparse != 0])
+    # the pairs left out of the sparse matrix are beyond the cutoff (1.5)
+    assert np.all(dense[sparse == 0] <= 1 / (1 + 1.5 ** 6) + 1e-12)
+    shifted = bulk.copy()
+    shifted.positions += 0.7 * bulk.cell.sum(axis=0)
+    assert np.allclose(atomtools.geo.get_contact_matrix(shifted), dense)
 
 
 def test_get_atoms_name():
@@ -165,6 +368,483 @@ def test_filetype():
             print(atomtools.filetype.filetype(fname))
 
 
+def test_filetype_rules():
+    tmpdir = tempfile.mkdtemp()
+    cases = {
+        'a.gjf': ('#p opt\n\ntitle\n\n0 1\nH 0 0 0\n', 'gaussian'),
+        'a.log': (' This is part of the Gaussian(R) 16 program',
+                  'gaussian-out'),
+        'a.xyz': ('1\ncomment\nH 0 0 0\n', 'xyz'),
+        'a.json': ('{\n  "PC_Compounds": [\n', 'pubchem-json'),
+        'my_POSCAR': ('POSCAR', 'POSCAR'),
+    }
+    for name, (content, expected) in cases.items():
+        filename = os.path.join(tmpdir, name)
+        with open(filename, 'w') as fd:
+            fd.write(content)
+        print(name, atomtools.filetype.filetype(filename))
+        assert atomtools.filetype.filetype(filename) == expected
+    results = dict(atomtools.filetype.scan_filetypes(tmpdir, nprocs=2))
+    assert results == {os.path.join(tmpdir, name): expected
+                       for name, (_, expected) in cases.items()}
+    cache = atomtools.filetype_cache.FiletypeCache(
+        os.path.join(tmpdir, 'cache', 'filetype.sqlite'))
+    for _ in range(2):
+        cached = dict(atomtools.filetype.scan_filetypes(
+            tmpdir, nprocs=2, cache=cache, recursive=False))
+        assert cached == results
+    filename = os.path.join(tmpdir, 'a.xyz')
+    assert cache.get(filename, atomtools.filetype._cache_config(None))[0]
+    with open(filename, 'a') as fd:
+        fd.write('\n')
+    assert not cache.get(filename, atomtools.filetype._cache_config(None))[0]
+    assert atomtools.filetype.filetype(filename, cache=cache) == 'xyz'
+    cache.close()
+    shutil.rmtree(tmpdir)
+
+
+def test_filetype_rules_parity():
+    import re
+    filetype = atomtools.filetype
+
+    def old_match(fmt_regexp, name, content):
+        name_regexp, content_regexp = (fmt_regexp.split('&&') + [None])[:2]
+        if not re.match(name_regexp.strip(), name):
+            return False
+        if content and content_regexp:
+            if not content_regexp.startswith('^'):
+                content_regexp = filetype.REG_ANYSTRING + \
+                    content_regexp.strip()
+            if not content_regexp.endswith('$'):
+                content_regexp = content_regexp.strip() + \
+                    filetype.REG_ANYSTRING
+            return bool(re.match(content_regexp.strip(), content))
+        return True
+
+    assert len(filetype.RULES) == len(filetype.FORMATS_REGEXP)
+    names = set(['POSCAR', 'a', 'x.log.bak', 'logfile', 'run.out'])
+    for extension in filetype.RULES_BY_EXTENSION:
+        names.update(['a' + extension, 'x' + extension + '.bak'])
+    contents = ['', 'x\nadf -n 4', '$ADFBIN/adf', 'adf -n 4\n',
+                ' Entering Gaussian System', '#p opt\n\nt\n\n0 1\nH 0 0 0\n',
+                '1\ncomment\nH 0 0 0\n', 'Amsterdam Density Functional']
+    for name, content in itertools.product(sorted(names), contents):
+        old = [fmt_filetype for fmt_regexp, fmt_filetype in
+               filetype.FORMATS_REGEXP.items()
+               if old_match(fmt_regexp, name, content)]
+        new = [filetype.RULES[index][2] for index in
+               filetype.candidate_rules(name)
+               if filetype.match_rule(filetype.RULES[index], name, content)]
+        assert old == new, (name, content, old, new)
+
+
+def test_cli():
+    import io
+    import sys
+    import json
+    import contextlib
+    import subprocess
+    import atomtools.cli
+    tmpdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(tmpdir, 'sub'))
+    cases = {
+        'a.xyz': ('1\ncomment\nH 0 0 0\n', 'xyz'),
+        os.path.join('sub', 'a.gjf'): ('#p opt\n\ntitle\n\n0 1\nH 0 0 0\n',
+                                       'gaussian'),
+    }
+    for name, (content, _) in cases.items():
+        with open(os.path.join(tmpdir, name), 'w') as fd:
+            fd.write(content)
+    expected = {os.path.join(tmpdir, name): ftype
+                for name, (_, ftype) in cases.items()}
+    cmd = [sys.executable, '-m', 'atomtools.cli']
+    proc = subprocess.run(cmd + ['filetype', '-j', '2', tmpdir],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    assert proc.returncode == 0, proc.stderr
+    lines = [json.loads(line) for line in proc.stdout.splitlines()]
+    assert all(set(line) == {'filename', 'filetype'} for line in lines)
+    assert {line['filename']: line['filetype'] for line in lines} == expected
+    # --no-recursive and -o
+    output = os.path.join(tempfile.mkdtemp(), 'out.jsonl')
+    atomtools.cli.run_atomtools_cli(
+        ['filetype', '--no-recursive', '-j', '1', '-o', output, tmpdir])
+    with open(output) as fd:
+        lines = [json.loads(line) for line in fd]
+    assert lines == [{'filename': os.path.join(tmpdir, 'a.xyz'),
+                      'filetype': 'xyz'}]
+    formats = atomtools.filetype.list_supported_formats()
+    for argv, lines in [(['formats'], formats),
+                        (['version'], [atomtools.version()])]:
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            atomtools.cli.run_atomtools_cli(argv)
+        assert stdout.getvalue().splitlines() == sorted(set(lines))
+    for argv in [['filetype'], ['filetype', '-j', 'x', tmpdir], ['unknown']]:
+        proc = subprocess.run(cmd + argv, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+        assert proc.returncode == 2, argv
+    shutil.rmtree(tmpdir)
+    shutil.rmtree(os.path.dirname(output))
+
+
+def test_uncompressed_file():
+    import gzip
+    import bz2
+    import lzma
+    import zipfile
+    tmpdir = tempfile.mkdtemp()
+    content = '#p opt\r\n\r\ntitle\r\n\r\n0 1\r\nH 0 0 0\r\n' * 100
+    for extension, opener in [('.gz', gzip.open), ('.bz2', bz2.open),
+                              ('.xz', lzma.open)]:
+        filename = os.path.join(tmpdir, 'a.gjf' + extension)
+        with opener(filename, 'wt', newline='') as fd:
+            fd.write(content)
+        assert atomtools.fileutil.read_uncompressed(filename, 6) == b'#p opt'
+        lines = list(atomtools.fileutil.iter_uncompressed_lines(filename))
+        assert lines == content.replace('\r', '').splitlines(True)
+        fileobj = atomtools.fileutil.get_uncompressed_fileobj(filename, 20)
+        assert fileobj.read() == content[:20].replace('\r', '')
+        assert fileobj.name == 'a.gjf'
+        assert atomtools.filetype.filetype(filename) == 'gaussian'
+    filename = os.path.join(tmpdir, 'a.gjf.zip')
+    with zipfile.ZipFile(filename, 'w') as archive:
+        archive.writestr('a.gjf', content)
+    assert atomtools.filetype.filetype(filename) == 'gaussian'
+    # decompression commands are waited for, failures raise
+    compress_command = atomtools.fileutil.compress_command
+    compress_command['.gzc'] = 'gzip -dc'
+    try:
+        filename = os.path.join(tmpdir, 'a.gjf.gzc')
+        with gzip.open(filename, 'wt', newline='') as fd:
+            fd.write(content * 100)
+        children = set(psutil.Process().children())
+        assert atomtools.fileutil.read_uncompressed(filename, 6) == b'#p opt'
+        lines = list(atomtools.fileutil.iter_uncompressed_lines(filename))
+        assert lines == (content * 100).replace('\r', '').splitlines(True)
+        assert set(psutil.Process().children()) == children
+        with open(filename, 'wb') as fd:
+            fd.write(b'not gzip')
+        try:
+            atomtools.fileutil.read_uncompressed(filename)
+            raise AssertionError('failed command not raised')
+        except OSError:
+            pass
+    finally:
+        del compress_command['.gzc']
+    shutil.rmtree(tmpdir)
+
+
+def test_file_encoding():
+    fileutil = atomtools.fileutil
+    assert fileutil.decode_bytes('Å 1.0'.encode('utf-8')) == 'Å 1.0'
+    # cut inside the last character of a UTF-8 head
+    assert fileutil.detect_encoding('ÅÅ'.encode('utf-8')[:3]) == 'utf-8'
+    content = 'Sch\u00f6n gr\u00fc\u00dfe aus K\u00f6ln, \u00e9t\u00e9\n' * 50
+    assert fileutil.decode_bytes(content.encode('latin-1')) == content
+    assert fileutil.decode_bytes(b'\xc5', encoding='cp1252') == 'Å'
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'a.xyz')
+    with open(filename, 'wb') as fd:
+        fd.write(b'1\r\nH\r\n')
+    assert fileutil.get_file_content(filename, is_filename=True) == '1\nH\n'
+    assert fileutil.get_file_content(filename, is_filename=True,
+                                     binary=True) == b'1\r\nH\r\n'
+    shutil.rmtree(tmpdir)
+
+
+def test_mapped_file_content():
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'a.log')
+    content = ''.join(f' SCF Done:  E(RB3LYP) =  -{i}.5  Å\r\n'
+                      for i in range(1000))
+    with open(filename, 'wb') as fd:
+        fd.write(content.encode('utf-8'))
+    with atomtools.fileutil.MappedFileContent(filename) as mapped:
+        assert len(mapped) == len(content.encode('utf-8'))
+        assert mapped.encoding == 'utf-8'
+        matches = list(mapped.finditer(rb'= +(-\d+\.\d+)'))
+        assert [float(x.group(1)) for x in matches] == \
+            [-i - 0.5 for i in range(1000)]
+        lines = list(mapped.iter_lines())
+        assert lines == content.replace('\r', '').splitlines()
+        assert ''.join(mapped.iter_windows(100)) == content.replace('\r', '')
+        # windows never cut a character
+        start = mapped.find('Å'.encode('utf-8')) + 1
+        assert mapped.decode(start, start + 10).startswith('\n')
+    filename = os.path.join(tmpdir, 'empty')
+    open(filename, 'w').close()
+    with atomtools.fileutil.MappedFileContent(filename) as mapped:
+        assert len(mapped) == 0 and list(mapped.iter_lines()) == []
+        assert mapped.search(rb'x') is None
+    shutil.rmtree(tmpdir)
+
+
+def test_frame_index():
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'traj.xyz')
+    frames = [f'{n}\nframe {i}\n' + 'H 0.0 0.0 1.0\n' * n
+              for i, n in enumerate([3, 1, 12, 2, 5])]
+    with open(filename, 'w') as fd:
+        fd.write(''.join(frames))
+    index = atomtools.frameindex.FrameIndex(filename)
+    assert len(index) == len(frames)
+    assert [index.read_frame(k) for k in range(len(frames))] == frames
+    assert list(index.iter_frames(1, 3)) == frames[1:3]
+    assert [x[:2] for x in index.chunks(2)] == [(0, 2), (2, 5)]
+    assert os.path.exists(filename + atomtools.frameindex.FRAME_INDEX_SUFFIX)
+    assert index.load() is not None
+    with open(filename, 'a') as fd:
+        fd.write(frames[0])
+    assert index.load() is None
+    assert len(atomtools.frameindex.FrameIndex(filename)) == len(frames) + 1
+    # appended while indexing: the truncated offsets are not saved
+    os.remove(filename + atomtools.frameindex.FRAME_INDEX_SUFFIX)
+    index = atomtools.frameindex.FrameIndex(filename, persist=False)
+    with open(filename, 'a') as fd:
+        fd.write(frames[1])
+    index.save()
+    assert not os.path.exists(
+        filename + atomtools.frameindex.FRAME_INDEX_SUFFIX)
+    shutil.rmtree(tmpdir)
+
+
+def test_unit_convert():
+    unit = atomtools.unit
+    assert unit.parse_unit('kcal/mol/ang^2')[1] == (0, 1, -2)
+    assert unit.parse_unit('kcal/mol/ang**2') == \
+        unit.parse_unit('kcal/mol/ang^2')
+    assert abs(unit.get_conversion_factor('hartree/bohr', 'eV/Ang') -
+               unit.trans_force('au')) < 1e-10
+    factor = unit.get_conversion_factor('kJ/mol', 'kcal/mol')
+    assert abs(factor - 1/4.184) < 1e-12
+    forces = np.ones((10, 3))
+    out = unit.convert(forces, 'hartree/bohr', 'eV/ang', inplace=True)
+    assert out is forces and np.allclose(forces, 51.42208619)
+    assert np.allclose(unit.convert([1, 2], 'nm', 'ang'), [10, 20])
+    for src, dest in [('ev', 'ang'), ('au/fs', 'ang/fs'), ('ang*', 'ang')]:
+        try:
+            unit.get_conversion_factor(src, dest)
+        except ValueError:
+            continue
+        raise AssertionError(f'{src} -> {dest} should fail')
+    # au inside a compound is the atomic unit of its segment, as before
+    for func, src, dest, value in [
+            (unit.trans_velocity, 'bohr/au', 'ang/fs', 21.876912636452662),
+            (unit.trans_velocity, 'ang/au', 'au', 1.8897261246221992),
+            (unit.trans_force, 'au/ang', 'ev/ang', 27.211386245988653),
+            (unit.trans_force, 'ev/au', 'hartree/bohr', 0.03674932217565411),
+            (unit.trans_energy, 'au/mol', 'kj/mol', 4.3597447222072e-21)]:
+        assert abs(func(src, dest) / value - 1) < 1e-10, (src, dest)
+
+
+def test_ExtArray():
+    symbols = ['C', 'C', 'H', 'H', 'H', 'C', 'O', 'H']
+    extlist = atomtools.ext_types.ExtList(symbols)
+    extarray = atomtools.ext_types.ExtArray(symbols)
+    for method in ['contract_items', 'contract_numbers',
+                   'deep_contract_items', 'deep_contract_numbers']:
+        for outtype in [None, 'string']:
+            expected = getattr(extlist, method)(outtype)
+            result = getattr(extarray, method)(outtype)
+            print(method, outtype, result)
+            assert type(result) is type(expected)
+            assert list(result) == list(expected)
+    assert extarray.deep_contract_index() == extlist.deep_contract_index()
+    numbers = [1, 0, 2, 1, 1, 3, 1, 1]
+    assert (extarray * numbers).tolist() == list(extlist * numbers)
+    assert (extarray - 'H').tolist() == list(extlist - 'H')
+    assert atomtools.ext_types.ExtArray([]).contract_numbers() == []
+
+
+def test_get_atoms_arrays():
+    atoms = ase.build.molecule('CH4')
+    arrays = atomtools.methods.get_atoms_arrays(atoms, copy=False)
+    assert np.shares_memory(arrays['positions'], atoms.positions)
+    assert not arrays['positions'].flags.writeable
+    arrays = atomtools.methods.get_atoms_arrays(atoms)
+    assert not np.shares_memory(arrays['positions'], atoms.positions)
+    images = [atoms.copy() for _ in range(4)]
+    for i, image in enumerate(images):
+        image.positions += i
+    packed = atomtools.methods.get_atoms_arrays(images, packed=True)
+    assert len(packed) == 4 and packed.positions.shape == (4, 5, 3)
+    assert packed.positions.flags.c_contiguous
+    for i, frame in enumerate(packed):
+        assert np.allclose(frame['positions'], images[i].positions)
+        assert np.allclose(frame['cell'], images[i].cell.array)
+    assert len(packed[1:3]) == 2
+    assert np.allclose(atomtools.geo.get_batch_distances(packed, [0, 1]),
+                       atoms.get_distance(0, 1))
+
+
+def test_trajectory():
+    atoms = ase.build.molecule('CH3CH2OH')
+    traj = atomtools.trajectory.Trajectory(atoms.numbers)
+    for i in range(40):
+        traj.append(atoms.positions + 0.01 * i, energy=-float(i))
+    assert len(traj) == 40 and traj.capacity >= 40
+    assert traj.positions.shape == (40, len(atoms), 3)
+    assert traj.cells is None
+    part = traj[10:20]
+    assert np.shares_memory(part.positions, traj.positions)
+    assert np.allclose(part.scalars['energy'], -np.arange(10, 20))
+    part.append(atoms.positions, energy=1.0)
+    assert traj.scalars['energy'][20] == -20.0
+    frame = traj[3]
+    assert np.allclose(frame.positions, atoms.positions + 0.03)
+    assert np.allclose(atomtools.geo.get_batch_distances(traj, [0, 1])[:, 0],
+                       atoms.get_distance(0, 1))
+    for func in (atomtools.geo.get_distance_matrix,
+                 atomtools.geo.get_contact_matrix):
+        try:
+            func(traj)
+            raise AssertionError(f'{func.__name__} accepted a trajectory')
+        except ValueError:
+            pass
+    assert np.allclose(atomtools.geo.get_distance_matrix(frame),
+                       atoms.get_all_distances())
+    tmpdir = tempfile.mkdtemp()
+    traj.save(tmpdir)
+    loaded = atomtools.trajectory.Trajectory.load(tmpdir)
+    assert isinstance(loaded.positions, np.memmap)
+    assert np.allclose(loaded.positions, traj.positions)
+    assert np.allclose(loaded.scalars['energy'], traj.scalars['energy'])
+    loaded.append(atoms.positions)
+    assert len(loaded) == 41 and np.isnan(loaded.scalars['energy'][-1])
+    shutil.rmtree(tmpdir)
+
+
+def test_system_resources():
+    system = atomtools.system
+    tmpdir = tempfile.mkdtemp()
+    cgroup_root, proc_cgroup = system.CGROUP_ROOT, system.PROC_CGROUP
+    environ = os.environ.copy()
+    try:
+        # a cgroup v2 container limited to 1.5 cores and 2 GB
+        os.makedirs(os.path.join(tmpdir, 'job'))
+        for name, value in [('cpu.max', '150000 100000'),
+                            ('memory.max', str(2 * 1024**3)),
+                            ('memory.current', str(1024**3)),
+                            ('cpu.stat', 'usage_usec 100\nuser_usec 50')]:
+            with open(os.path.join(tmpdir, 'job', name), 'w') as fd:
+                fd.write(value)
+        with open(os.path.join(tmpdir, 'cgroup'), 'w') as fd:
+            fd.write('0::/job\n')
+        system.CGROUP_ROOT = tmpdir
+        system.PROC_CGROUP = os.path.join(tmpdir, 'cgroup')
+        for name in system.SCHEDULER_CORE_ENVS + ['SLURM_MEM_PER_NODE']:
+            os.environ.pop(name, None)
+        assert system.get_cgroup_cpu_limit() == 1.5
+        if psutil.virtual_memory().total > 2 * 1024**3:
+            assert system.get_cgroup_memory() == (2 * 1024**3, 1024**3)
+            assert system.get_maxmem('GB') <= 0.9
+        assert system.get_cpu_limit() == 1
+        os.environ['SLURM_CPUS_PER_TASK'] = '4'
+        assert system.get_scheduler_cores() == 4
+        assert system.get_cpu_limit() == 1
+        assert system.get_load() >= 0
+        assert system.get_maxcore() >= 1
+    finally:
+        system.CGROUP_ROOT, system.PROC_CGROUP = cgroup_root, proc_cgroup
+        system._LOAD_STATE.clear()
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(tmpdir)
+    assert 1 <= system.get_cpu_limit() <= (os.cpu_count() or 1)
+
+
+def test_local_scheduler():
+    Status = atomtools.status.Status
+    tmpdir = tempfile.mkdtemp()
+    queue_file = os.path.join(tmpdir, 'queue.json')
+    scheduler = atomtools.scheduler.LocalScheduler(
+        queue_file, cores=2, memory='1GB', poll_interval=0.05)
+    for i in range(4):
+        scheduler.submit(f'echo {i} > out{i}', workdir=tmpdir)
+    scheduler.submit('exit 3', name='bad', workdir=tmpdir)
+    scheduler.submit('sleep 0.2', cores=2, memory='512MB', workdir=tmpdir)
+    try:
+        scheduler.submit('true', cores=3)
+        raise AssertionError('job larger than the allocation accepted')
+    except ValueError:
+        pass
+    scheduler.step()
+    assert len(scheduler.get_jobs(Status.running)) == 2
+    jobs = scheduler.run(timeout=30)
+    assert [job.status for job in jobs] == [Status.complete] * 4 + \
+        [Status.error, Status.complete]
+    assert scheduler.jobs['bad'].returncode == 3
+    assert open(os.path.join(tmpdir, 'out2')).read().strip() == '2'
+    # a new scheduler restarts from the queue file
+    scheduler.submit('sleep 0.2', name='late', workdir=tmpdir)
+    restarted = atomtools.scheduler.LocalScheduler(
+        queue_file, cores=2, memory='1GB', poll_interval=0.05)
+    assert restarted.jobs['bad'].status == Status.error
+    assert restarted.jobs['late'].status == Status.unfinished
+    restarted.run(timeout=30)
+    assert restarted.jobs['late'].status == Status.complete
+    # a cancelled job has exited (no zombie) before its cores are freed
+    job = restarted.submit('sleep 30', cores=2, workdir=tmpdir)
+    restarted.step()
+    pid = job.pid
+    restarted.cancel(job.name)
+    assert job.status == Status.stopped and job.returncode is not None
+    assert not psutil.pid_exists(pid)
+    assert restarted.free_resources()[0] == 2
+    # a job which can not start does not stop the queue
+    missing = restarted.submit('true', workdir=os.path.join(tmpdir, 'no'))
+    other = restarted.submit('true', workdir=tmpdir)
+    restarted.run(timeout=30)
+    assert missing.status == Status.error and missing.end_time
+    assert other.status == Status.complete
+    # queued jobs larger than a smaller allocation are stopped on load
+    big = restarted.submit('true', cores=2, workdir=tmpdir)
+    small = atomtools.scheduler.LocalScheduler(
+        queue_file, cores=1, memory='1GB', poll_interval=0.05)
+    assert small.jobs[big.name].status == Status.stopped
+    small.run()
+    shutil.rmtree(tmpdir)
+
+
+def test_status_monitor():
+    Status = atomtools.status.Status
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'a.log')
+    monitor = atomtools.status.StatusMonitor()
+    assert monitor.poll(filename) == Status.unfinished
+    with open(filename, 'w') as fd:
+        fd.write(' Entering Gaussian System, Link 0=g16\n' +
+                 ' SCF Done\n' * 100)
+    assert monitor.poll(filename, 'gaussian-out') == Status.running
+    with open(filename, 'a') as fd:
+        fd.write(' Normal termi')
+    assert monitor.poll(filename) == Status.running
+    with open(filename, 'a') as fd:
+        fd.write('nation of Gaussian 16 at Mon Jan  1 00:00:00 2024.\n')
+    assert monitor.poll(filename) == Status.complete
+    # a next step of the job runs after a complete one
+    with open(filename, 'a') as fd:
+        fd.write(' SCF Done\n' * 1000)
+    assert monitor.poll(filename) == Status.running
+    with open(filename, 'a') as fd:
+        fd.write(' Error termination via Lnk1e\n')
+    assert monitor.poll(filename) == Status.error
+    # truncated files are scanned again
+    with open(filename, 'w') as fd:
+        fd.write(' SCF Done\n')
+    assert monitor.poll(filename) == Status.running
+    old = time.time() - 2 * monitor.max_active_time
+    os.utime(filename, (old, old))
+    assert monitor.poll(filename) == Status.stopped
+    # the modification time of a file out of the working directory
+    assert atomtools.fileutil.file_exist(filename)
+    assert not atomtools.fileutil.file_active(filename)
+    assert atomtools.fileutil.get_time_since_lastmod(filename) > \
+        monitor.max_active_time
+    shutil.rmtree(tmpdir)
+
+
 def test_ExtDict():
     test_cases = {
         'positions': np.zeros((10, 3)),
@@ -193,12 +873,66 @@ def test_ExtDict():
     print('/calc_arrays/basis', x.has_key('/calc_arrays/basis'))
     print('/xyz', x.has_key('/xyz'))
 
+    print('-'*25+'\n'+'test view/get_many/set_many')
+    view = x.view('calc_arrays')
+    view['command'] = 'test_view'
+    assert x['calc_arrays/command'] == 'test_view'
+    x['/calc_arrays/options/scf'] = 'tight'
+    assert view['options/scf'] == 'tight'
+    x.set_many({'calc_arrays/command': 'bulk', 'energy': -1.0})
+    assert x.get_many(['calc_arrays/command', 'energy', '/xyz'], None) == \
+        ['bulk', -1.0, None]
+
+    print('-'*25+'\n'+'test keys_under/to_flat_arrays')
+    assert x.keys_under('/calc_arrays') == sorted(
+        key for key in x.get_all_keys() if key.startswith('/calc_arrays/'))
+    x['calc_arrays/options'] = {'scf': 'tight', 'grid': {'size': 99}}
+    view['ecp'] = {'H': 'none'}
+    assert x.keys_under('calc_arrays/options') == \
+        ['/calc_arrays/options/grid/size', '/calc_arrays/options/scf']
+    assert x.keys_under() == sorted(x.get_all_keys())
+    arrays = x.to_flat_arrays('/calc_arrays')
+    assert arrays['/calc_arrays/basis'].shape == (10,)
+    assert '/calc_arrays/ecp/H' in arrays and '/positions' not in arrays
+    # the plain dict methods keep keys_under up to date
+    x.pop('energy')
+    x.update(charge=0)
+    del x['numbers']
+    x.setdefault('spin', {'multiplicity': 1})
+    assert x.keys_under() == sorted(x.get_all_keys())
+    # nested dicts handed out by reference and written afterwards
+    y = atomtools.ext_types.ExtDict({'calc_arrays': {'a': 1}})
+    assert y.keys_under('/calc_arrays') == ['/calc_arrays/a']
+    y['calc_arrays']['b'] = 2
+    assert y.keys_under('/calc_arrays') == ['/calc_arrays/a', '/calc_arrays/b']
+    assert sorted(y.to_flat_arrays()) == sorted(y.get_all_keys())
+    nested = y.get('calc_arrays')
+    y.keys_under()
+    nested['c'] = {'d': 3}
+    assert y.keys_under() == sorted(y.get_all_keys())
+
 
 def test():
     print(atomtools.__file__)
     print(atomtools.version())
     print('-'*50+'\n'+'test_get_distance_matrix()')
     test_get_distance_matrix()
+    print('-'*50+'\n'+'test_get_neighbor_list()')
+    test_get_neighbor_list()
+    print('-'*50+'\n'+'test_find_mic()')
+    test_find_mic()
+    print('-'*50+'\n'+'test_batch_geometry()')
+    test_batch_geometry()
+    print('-'*50+'\n'+'test_freq_dist_change_matrix()')
+    test_freq_dist_change_matrix()
+    print('-'*50+'\n'+'test_cartesian_to_zmatrix_nearest()')
+    test_cartesian_to_zmatrix_nearest()
+    print('-'*50+'\n'+'test_zmatrix_to_cartesian()')
+    test_zmatrix_to_cartesian()
+    print('-'*50+'\n'+'test_kabsch()')
+    test_kabsch()
+    print('-'*50+'\n'+'test_rotation_matrices()')
+    test_rotation_matrices()
     print('-'*50+'\n'+'test_get_contact_matrix()')
     test_get_contact_matrix()
     print('-'*50+'\n'+'test_get_atoms_name()')
@@ -207,6 +941,34 @@ def test():
     test_get_atoms_size()
     print('-'*50+'\n'+'# test_filetype()')
     test_filetype()
+    print('-'*50+'\n'+'test_filetype_rules()')
+    test_filetype_rules()
+    print('-'*50+'\n'+'test_filetype_rules_parity()')
+    test_filetype_rules_parity()
+    print('-'*50+'\n'+'test_cli()')
+    test_cli()
+    print('-'*50+'\n'+'test_uncompressed_file()')
+    test_uncompressed_file()
+    print('-'*50+'\n'+'test_file_encoding()')
+    test_file_encoding()
+    print('-'*50+'\n'+'test_mapped_file_content()')
+    test_mapped_file_content()
+    print('-'*50+'\n'+'test_frame_index()')
+    test_frame_index()
+    print('-'*50+'\n'+'test_unit_convert()')
+    test_unit_convert()
+    print('-'*50+'\n'+'test_ExtArray()')
+    test_ExtArray()
+    print('-'*50+'\n'+'test_get_atoms_arrays()')
+    test_get_atoms_arrays()
+    print('-'*50+'\n'+'test_trajectory()')
+    test_trajectory()
+    print('-'*50+'\n'+'test_system_resources()')
+    test_system_resources()
+    print('-'*50+'\n'+'test_local_scheduler()')
+    test_local_scheduler()
+    print('-'*50+'\n'+'test_status_monitor()')
+    test_status_monitor()
     print('-'*50+'\n'+'# test_zmat()')
     # test_zmat()
     print('-'*50+'\n'+'test_ExtDict()')